@@ -0,0 +1,70 @@
+"""Per-request cost of the in-memory rate limiter at different client counts.
+
+    python bench_ratelimit.py [requests]
+
+For 1k, 100k and 1M distinct clients, runs RateLimitMiddleware with
+InMemoryRateLimitBackend around a no-op app and prints the time per
+request, the time for one sweep, and the eviction cost once max_keys is
+reached.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault("STRIPE_PUBLIC_KEY", "pk_test")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test")
+
+import main  # noqa: E402
+
+CLIENT_COUNTS = (1_000, 100_000, 1_000_000)
+
+
+async def app(scope, receive, send):
+    pass
+
+
+def client_scopes(count, offset=0):
+    return [
+        {"type": "http", "path": "/pay/abc", "client": (f"10.0.{i}", 1)}
+        for i in range(offset, offset + count)
+    ]
+
+
+async def per_request(middleware, scopes):
+    started = time.perf_counter()
+    for scope in scopes:
+        await middleware(scope, None, None)
+    return (time.perf_counter() - started) / len(scopes) * 1e6
+
+
+async def run(clients, requests):
+    backend = main.InMemoryRateLimitBackend(max_keys=clients)
+    middleware = main.RateLimitMiddleware(
+        app, rate_limit=10**9, backend=backend, policies={}
+    )
+    scopes = client_scopes(clients)
+    await per_request(middleware, scopes)  # every client seen once
+
+    hits = await per_request(
+        middleware, [random.choice(scopes) for _ in range(requests)]
+    )
+    # New clients at max_keys, each evicting the least recently seen.
+    evictions = await per_request(
+        middleware, client_scopes(min(requests, clients), offset=clients)
+    )
+    started = time.perf_counter()
+    await backend.sweep()
+    sweep_ms = (time.perf_counter() - started) * 1000
+    print(
+        f"{clients:>9} clients: {hits:.2f} us/request, "
+        f"{evictions:.2f} us/evicting request, sweep {sweep_ms:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    for clients in CLIENT_COUNTS:
+        asyncio.run(run(clients, requests))
@@ -0,0 +1,58 @@
+"""Template compile and render times, default Jinja settings vs main.py's.
+
+    python bench_templates.py [renders]
+
+Compares a plain Environment (auto_reload on, no bytecode cache) with
+main.template_env: the time to compile every template, then the time per
+get_template() + render() for each one, as a request would do.
+"""
+
+import os
+import sys
+import time
+
+os.environ.setdefault("STRIPE_PUBLIC_KEY", "pk_test")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test")
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+from jinja2 import Environment, FileSystemLoader  # noqa: E402
+
+import main  # noqa: E402
+
+CONTEXT = {
+    "message": "Payment has already been made.",
+    "title": "Error",
+    "content": "Something went wrong.",
+    "amount": "19.99",
+    "currency": "usd",
+    "order_id": "order-1",
+    "email": "buyer@example.com",
+    "token": "0" * 32,
+}
+
+
+def bench(env, label, renders):
+    names = env.list_templates(extensions=["html"])
+    started = time.perf_counter()
+    for name in names:
+        env.get_template(name)
+    compile_ms = (time.perf_counter() - started) * 1000
+    print(f"{label}: compile all {compile_ms:.1f} ms")
+    for name in names:
+        started = time.perf_counter()
+        for _ in range(renders):
+            env.get_template(name).render(CONTEXT)
+        per_render = (time.perf_counter() - started) / renders * 1e6
+        print(f"  {name:24} {per_render:6.1f} us/render")
+
+
+def run(renders):
+    default_env = Environment(loader=FileSystemLoader("templates"), autoescape=True)
+    default_env.globals.update(main.template_env.globals)
+    bench(default_env, "default (auto_reload, no bytecode cache)", renders)
+    main.template_env.cache.clear()
+    bench(main.template_env, "main.template_env", renders)
+
+
+if __name__ == "__main__":
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20_000)
@@ -0,0 +1,213 @@
+"""Build the self-hosted stylesheet served from /static.
+
+Purges Bootstrap down to the selectors the templates use and writes it as
+a content-hashed file, plus static/manifest.json with its URL and each
+template's critical CSS (inlined into the page by main.py).
+
+    python build_assets.py [path/to/bootstrap.min.css]
+
+Without a path, the pinned Bootstrap release is downloaded from jsDelivr.
+Rerun after changing the classes or elements used in templates/.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib.request
+
+BOOTSTRAP_VERSION = "5.3.8"
+BOOTSTRAP_URL = (
+    f"https://cdn.jsdelivr.net/npm/bootstrap@{BOOTSTRAP_VERSION}"
+    "/dist/css/bootstrap.min.css"
+)
+LICENSE_BANNER = (
+    f"/*! Bootstrap v{BOOTSTRAP_VERSION} | MIT License"
+    " | https://github.com/twbs/bootstrap/blob/main/LICENSE */"
+)
+TEMPLATE_DIR = "templates"
+STATIC_DIR = "static"
+STYLESHEET = "css/app.css"  # logical name, see asset_url in main.py
+# Nested rules are purged recursively; other at-rules (@keyframes,
+# @font-face, ...) are dropped.
+GROUPING_AT_RULES = ("@media", "@supports", "@layer", "@container")
+
+
+def split_blocks(css):
+    """Top-level ``(prelude, body)`` pairs; ``body`` is None for statements
+    such as ``@charset``."""
+    blocks = []
+    depth = start = body_start = 0
+    i = 0
+    while i < len(css):
+        char = css[i]
+        if char in "\"'":
+            i = css.index(char, i + 1)
+        elif char == "{":
+            if depth == 0:
+                body_start = i + 1
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                blocks.append((css[start : body_start - 1].strip(), css[body_start:i]))
+                start = i + 1
+        elif char == ";" and depth == 0:
+            blocks.append((css[start:i].strip(), None))
+            start = i + 1
+        i += 1
+    return blocks
+
+
+def split_top_level(text, separator):
+    """Split on ``separator`` outside parentheses and quotes."""
+    parts, depth, start, quote = [], 0, 0, None
+    for i, char in enumerate(text):
+        if quote:
+            quote = None if char == quote else quote
+        elif char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def page_tokens(html):
+    """Classes, element names and attribute names used in a template."""
+    classes = set()
+    for value in re.findall(r'class="([^"]*)"', html):
+        classes.update(re.sub(r"{{.*?}}|{%.*?%}", " ", value).split())
+    elements = {tag.lower() for tag in re.findall(r"<([a-zA-Z][\w-]*)", html)}
+    attributes = {name.lower() for name in re.findall(r"\s([\w:-]+)=", html)}
+    return classes, elements | {"html", "body"}, attributes
+
+
+def selector_used(selector, tokens):
+    """Whether every class, element and attribute the selector requires
+    appears in ``tokens``. Pseudo-classes and negations are ignored, which
+    keeps a few rules that cannot match but never drops one that can."""
+    classes, elements, attributes = tokens
+    selector = selector.strip()
+    while True:
+        stripped = re.sub(r":[\w-]+\([^()]*\)", "", selector)
+        if stripped == selector:
+            break
+        selector = stripped
+    for name in re.findall(r"\[\s*([\w:-]+)", selector):
+        if name.lower() not in attributes:
+            return False
+    selector = re.sub(r"\[[^\]]*\]", "", selector)
+    selector = re.sub(r"::?[\w-]+", "", selector)
+    for name in re.findall(r"\.((?:\\.|[\w-])+)", selector):
+        if name not in classes:
+            return False
+    selector = re.sub(r"[.#](?:\\.|[\w-])+", "", selector)
+    return all(
+        name.lower() in elements for name in re.findall(r"[a-zA-Z][\w-]*", selector)
+    )
+
+
+def purge_blocks(css, tokens):
+    out = []
+    for prelude, body in split_blocks(css):
+        if body is None:
+            continue
+        if prelude.startswith(GROUPING_AT_RULES):
+            inner = purge_blocks(body, tokens)
+            if inner:
+                out.append(f"{prelude}{{{inner}}}")
+        elif not prelude.startswith("@"):
+            selectors = [
+                s for s in split_top_level(prelude, ",") if selector_used(s, tokens)
+            ]
+            if selectors:
+                out.append(f"{','.join(s.strip() for s in selectors)}{{{body}}}")
+    return "".join(out)
+
+
+def prune_root_variables(css):
+    """Drop ``--bs-*`` custom properties on :root that nothing references."""
+    root_rules = [(p, b) for p, b in split_blocks(css) if p == ":root"]
+    declarations = [
+        d for _, body in root_rules for d in split_top_level(body, ";") if d
+    ]
+    rest = css
+    for prelude, body in root_rules:
+        rest = rest.replace(f"{prelude}{{{body}}}", "", 1)
+
+    used = set(re.findall(r"var\((--[\w-]+)", rest))
+    definitions = {d.split(":", 1)[0].strip(): d for d in declarations}
+    pending = list(used)
+    while pending:
+        for name in re.findall(r"var\((--[\w-]+)", definitions.get(pending.pop(), "")):
+            if name not in used:
+                used.add(name)
+                pending.append(name)
+
+    kept = [
+        d
+        for d in declarations
+        if not d.strip().startswith("--") or d.split(":", 1)[0].strip() in used
+    ]
+    root = f":root{{{';'.join(kept)}}}" if kept else ""
+    return root + rest
+
+
+def purge(css, tokens):
+    return LICENSE_BANNER + prune_root_variables(purge_blocks(css, tokens))
+
+
+def read_bootstrap(source=None):
+    if source:
+        with open(source, encoding="utf-8") as f:
+            css = f.read()
+    else:
+        with urllib.request.urlopen(BOOTSTRAP_URL) as response:
+            css = response.read().decode("utf-8")
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    return css.removeprefix('@charset "UTF-8";')
+
+
+def main(source=None):
+    css = read_bootstrap(source)
+    templates = {}
+    for path in sorted(glob.glob(os.path.join(TEMPLATE_DIR, "*.html"))):
+        with open(path, encoding="utf-8") as f:
+            templates[os.path.basename(path)] = page_tokens(f.read())
+
+    all_tokens = tuple(
+        set().union(*(t[i] for t in templates.values())) for i in range(3)
+    )
+    stylesheet = purge(css, all_tokens)
+    digest = hashlib.sha256(stylesheet.encode("utf-8")).hexdigest()[:12]
+    stem, ext = os.path.splitext(STYLESHEET)
+    hashed = f"{stem}.{digest}{ext}"
+
+    os.makedirs(os.path.join(STATIC_DIR, os.path.dirname(STYLESHEET)), exist_ok=True)
+    for old in glob.glob(os.path.join(STATIC_DIR, f"{stem}.*{ext}")):
+        os.remove(old)
+    with open(os.path.join(STATIC_DIR, hashed), "w", encoding="utf-8") as f:
+        f.write(stylesheet)
+
+    manifest = {
+        "files": {STYLESHEET: hashed},
+        "critical_css": {
+            name: purge(css, tokens) for name, tokens in templates.items()
+        },
+    }
+    with open(os.path.join(STATIC_DIR, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write("\n")
+    print(f"{STATIC_DIR}/{hashed}: {len(stylesheet)} bytes (from {len(css)})")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
@@ -1,28 +1,79 @@
 import os
+import base64
+import csv
+import gzip
+import hashlib
+import json
 import uuid
+import secrets
+import socket
+import sys
+import asyncio
 import time
 import logging
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from typing import Optional, Annotated
+from typing import Optional, Annotated, Literal, NamedTuple
 from decimal import Decimal
+from io import StringIO
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request, Form, Depends
+from fastapi import FastAPI, HTTPException, Request, Form, Depends, Header
 from fastapi.responses import (
     Response,
     RedirectResponse,
     HTMLResponse,
-    FileResponse,
     JSONResponse,
+    StreamingResponse,
 )
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from pydantic import BaseModel, EmailStr, Field, field_validator
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Float
+from starlette.datastructures import Headers, MutableHeaders
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, pass_context
+from markupsafe import Markup
+from pydantic import (
+    BaseModel,
+    EmailStr,
+    Field,
+    ValidationError,
+    field_validator,
+    model_validator,
+)
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    DateTime,
+    LargeBinary,
+    Index,
+    and_,
+    case,
+    delete,
+    event,
+    inspect,
+    select,
+    func,
+    insert,
+    text,
+    update,
+    tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.sql import column, table
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
 import stripe
 
+try:
+    import brotli
+except ImportError:  # optional, see the "brotli" extra
+    brotli = None
+
 # ---------------------------
 # Logging Setup
 # ---------------------------
@@ -35,115 +86,1656 @@ logger = logging.getLogger(__name__)
 load_dotenv()
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
 if not STRIPE_PUBLIC_KEY or not STRIPE_SECRET_KEY:
     logger.error("Stripe keys are not set in .env file")
     raise Exception("Stripe keys must be set in .env file.")
 
-stripe.api_key = STRIPE_SECRET_KEY
+# Optional override so the gateway can be pointed at a local fake Stripe server.
+STRIPE_API_BASE = os.getenv("STRIPE_API_BASE")
+STRIPE_MAX_CONCURRENCY = int(os.getenv("STRIPE_MAX_CONCURRENCY", "10"))
+STRIPE_TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", "10"))
 MY_DOMAIN = "http://localhost:8000"
+# "memory" (per process) or "redis" (shared across workers)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Payment link cache for the customer pages: "redis", "memory" or "none".
+# Off unless Redis is configured: "memory" only sees its own process's
+# status changes, so it is only safe with a single worker.
+LINK_CACHE_BACKEND = os.getenv(
+    "LINK_CACHE_BACKEND", "redis" if os.getenv("REDIS_URL") else "none"
+)
+LINK_CACHE_TTL = int(os.getenv("LINK_CACHE_TTL", "60"))  # seconds
+LINK_CACHE_SIZE = int(os.getenv("LINK_CACHE_SIZE", "10000"))
+# Seconds an Idempotency-Key response is kept, and how often expired ones
+# are evicted.
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 60 * 60)))
+IDEMPOTENCY_SWEEP_INTERVAL = int(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL", "300"))
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+# Background expiry of pending links: seconds between sweeps, and rows
+# updated per transaction.
+EXPIRY_SWEEP_INTERVAL = int(os.getenv("EXPIRY_SWEEP_INTERVAL", "60"))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "1000"))
+# Re-check template files for changes on every render (development only),
+# and where compiled templates are cached across restarts (default: a
+# per-user temp directory).
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "false").lower() == "true"
+TEMPLATE_CACHE_DIR = os.getenv("TEMPLATE_CACHE_DIR")
+# Items per transaction in /create_payment_links/bulk
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+# Rows fetched per round trip by /payments/export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+MAX_PER_PAGE = int(os.getenv("MAX_PER_PAGE", "100"))
+# Seconds a /payments total count is reused for the same filters
+COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", "30"))
 
 # ---------------------------
 # Database Setup
 # ---------------------------
 
-DATABASE_URL = "sqlite:///./payments.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+# Async drivers for plain URLs, e.g. a DATABASE_URL=postgres://... from a PaaS.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+}
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./payments.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+
+def async_database_url(url):
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+def engine_options(url):
+    options = {"pool_recycle": DB_POOL_RECYCLE, "pool_pre_ping": DB_POOL_PRE_PING}
+    if make_url(url).get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options["pool_size"] = DB_POOL_SIZE
+        options["max_overflow"] = DB_MAX_OVERFLOW
+    return options
+
+
+DATABASE_URL = async_database_url(DATABASE_URL)
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+
+# Applied to every new SQLite connection. WAL lets readers run alongside
+# the single writer, and synchronous=NORMAL is durable in WAL mode except
+# across an OS crash/power loss.
+SQLITE_PRAGMAS = {
+    # First, so the other pragmas wait for a lock held by another process.
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),  # ms
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # KiB if < 0
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+
+if engine.dialect.name == "sqlite":
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+# expire_on_commit=False: attributes stay loaded after commit, since lazy
+# refreshes are not allowed on an AsyncSession.
+SessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, autocommit=False, expire_on_commit=False
+)
 Base = declarative_base()
 
 
+LIVE_LINK_PREDICATE = "status IN ('pending', 'paid')"
+LINK_TTL = timedelta(minutes=5)  # how long a new link stays payable
+
+
+def link_expiry():
+    return datetime.now() + LINK_TTL
+
+
 class PaymentLink(Base):
     __tablename__ = "payment_links"
     id = Column(Integer, primary_key=True, index=True)
     token = Column(String, unique=True, index=True)
-    order_id = Column(String, index=True)
+    order_id = Column(String)
     email = Column(String, index=True)
-    amount = Column(Float)  # amount in dollars
+    amount_cents = Column(Integer, nullable=False)  # minor units, see to_minor_units
+    currency = Column(String, nullable=False, default="usd")
     created_at = Column(DateTime, default=datetime.now)
+    # Pending links past expires_at read as expired (see effective_status)
+    # until the expiry sweep writes the status.
+    expires_at = Column(DateTime, default=link_expiry)
     status = Column(String, default="pending")  # pending, paid, expired, cancelled
 
+    __table_args__ = (
+        # Keyset pagination order for /payments
+        Index("ix_payment_links_created_at_id", "created_at", "id"),
+        # Pending/paid lookup by order in create_payment_link and the bulk
+        # API; also serves plain order_id lookups.
+        Index(
+            "ix_payment_links_order_id_status_created_at",
+            "order_id",
+            "status",
+            "created_at",
+        ),
+        # At most one live (pending or paid) link per order, enforced by the
+        # database; see insert_pending_links.
+        Index(
+            "ux_payment_links_live_order_id",
+            "order_id",
+            unique=True,
+            sqlite_where=text(LIVE_LINK_PREDICATE),
+            postgresql_where=text(LIVE_LINK_PREDICATE),
+        ),
+        # /payments?status=... in keyset order
+        Index("ix_payment_links_status_created_at_id", "status", "created_at", "id"),
+        # Lazily expired pending links, and the expiry sweep
+        Index("ix_payment_links_status_expires_at", "status", "expires_at"),
+    )
+
+
+class ProcessedStripeEvent(Base):
+    """Stripe event ids already applied, so webhook retries are no-ops."""
+
+    __tablename__ = "processed_stripe_events"
+    id = Column(String, primary_key=True)
+    type = Column(String)
+    processed_at = Column(DateTime, default=datetime.now)
+
+
+class IdempotencyKey(Base):
+    """Stored response for an Idempotency-Key sent to /create_payment_link."""
+
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    request_hash = Column(String, nullable=False)  # sha256 of the request body
+    status_code = Column(Integer)  # NULL while the first request is in flight
+    response_body = Column(LargeBinary)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class SchedulerLease(Base):
+    """Named lease so a periodic job runs in one worker at a time."""
+
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    # Outcome of the job's last run, whichever worker ran it
+    last_run_at = Column(DateTime)
+    last_duration_ms = Column(Integer)
+    last_rows_affected = Column(Integer)
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String)
+    applied_at = Column(DateTime, default=datetime.now)
 
-Base.metadata.create_all(bind=engine)
+
+# ---------------------------
+# Search Index
+# ---------------------------
+# Substring search on order_id/email. A leading-wildcard LIKE cannot use a
+# B-tree index, so SQLite gets an FTS5 trigram table (kept in sync by
+# triggers) and Postgres gets pg_trgm GIN indexes that LIKE uses directly.
+payment_links_fts = table(
+    "payment_links_fts", column("rowid"), column("order_id"), column("email")
+)
+SEARCH_COLUMNS = ("order_id", "email")
+SQLITE_SEARCH_DDL = (
+    """CREATE TRIGGER IF NOT EXISTS payment_links_fts_ai
+    AFTER INSERT ON payment_links BEGIN
+        INSERT INTO payment_links_fts(rowid, order_id, email)
+        VALUES (new.id, new.order_id, new.email);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS payment_links_fts_ad
+    AFTER DELETE ON payment_links BEGIN
+        INSERT INTO payment_links_fts(payment_links_fts, rowid, order_id, email)
+        VALUES ('delete', old.id, old.order_id, old.email);
+    END""",
+    # Only the searched columns are indexed, so status-only updates leave
+    # the index untouched.
+    """CREATE TRIGGER IF NOT EXISTS payment_links_fts_au
+    AFTER UPDATE OF order_id, email ON payment_links BEGIN
+        INSERT INTO payment_links_fts(payment_links_fts, rowid, order_id, email)
+        VALUES ('delete', old.id, old.order_id, old.email);
+        INSERT INTO payment_links_fts(rowid, order_id, email)
+        VALUES (new.id, new.order_id, new.email);
+    END""",
+)
+search_backend = "like"  # set by create_search_index: "fts5", "pg_trgm" or "like"
 
 
-# Dependency to Get DB Session
-def get_db():
-    db = SessionLocal()
+def create_search_index(conn):
+    global search_backend
+    dialect = conn.dialect.name
     try:
+        if dialect == "sqlite":
+            exists = conn.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'payment_links_fts'"
+            ).first()
+            if not exists:
+                conn.exec_driver_sql(
+                    "CREATE VIRTUAL TABLE payment_links_fts USING fts5("
+                    "order_id, email, content='payment_links', "
+                    "content_rowid='id', tokenize='trigram')"
+                )
+                # Index rows that existed before the search table.
+                conn.exec_driver_sql(
+                    "INSERT INTO payment_links_fts(payment_links_fts) "
+                    "VALUES ('rebuild')"
+                )
+            for ddl in SQLITE_SEARCH_DDL:
+                conn.exec_driver_sql(ddl)
+            search_backend = "fts5"
+        elif dialect == "postgresql":
+            # Prefix searches (see search_filter) compare in code point order.
+            for name in SEARCH_COLUMNS:
+                conn.exec_driver_sql(
+                    f"CREATE INDEX IF NOT EXISTS ix_payment_links_{name}_c "
+                    f'ON payment_links ({name} COLLATE "C")'
+                )
+            # A savepoint, so a failure (e.g. no permission to create the
+            # extension) does not abort init_db's transaction.
+            with conn.begin_nested():
+                conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                for name in SEARCH_COLUMNS:
+                    conn.exec_driver_sql(
+                        f"CREATE INDEX IF NOT EXISTS ix_payment_links_{name}_trgm "
+                        f"ON payment_links USING gin ({name} gin_trgm_ops)"
+                    )
+            search_backend = "pg_trgm"
+    except Exception:
+        # e.g. SQLite < 3.34 has no trigram tokenizer; fall back to LIKE.
+        logger.exception("Search index unavailable, using LIKE scans.")
+        search_backend = "like"
+
+
+def substring_filter(name, value):
+    """WHERE clause for ``value`` appearing anywhere in column ``name``."""
+    pattern = f"%{value}%"
+    # Trigram indexes only help for patterns of 3+ characters.
+    if search_backend == "fts5" and len(value) >= 3:
+        fts_column = getattr(payment_links_fts.c, name)
+        return PaymentLink.id.in_(
+            select(payment_links_fts.c.rowid).where(fts_column.like(pattern))
+        )
+    if search_backend == "pg_trgm":
+        # Case-insensitive like SQLite's LIKE; pg_trgm indexes ILIKE too.
+        return getattr(PaymentLink, name).ilike(pattern)
+    return getattr(PaymentLink, name).like(pattern)
+
+
+def search_filter(name, value, match="contains"):
+    """WHERE clause for a search on ``name``: exact, prefix or contains.
+
+    Exact and prefix matches are case-sensitive and use the column's B-tree
+    index; contains goes through the search index.
+    """
+    field = getattr(PaymentLink, name)
+    if match == "exact":
+        return field == value
+    if match == "prefix":
+        # A range scan instead of LIKE 'x%', which SQLite only indexes for
+        # NOCASE columns. The range needs code point order: Postgres
+        # compares in the "C" collation, served by ix_payment_links_*_c.
+        if engine.dialect.name == "postgresql":
+            field = field.collate("C")
+        # The bound increments the last character below U+10FFFF, which has
+        # no successor; a prefix made only of those needs no upper bound.
+        stem = value.rstrip(chr(sys.maxunicode))
+        if not stem:
+            return field >= value
+        upper = stem[:-1] + chr(ord(stem[-1]) + 1)
+        return and_(field >= value, field < upper)
+    return substring_filter(name, value)
+
+
+# ---------------------------
+# Migrations
+# ---------------------------
+# Schema changes for databases created by an older version. Append new
+# steps to MIGRATIONS; their position is their version number. A fresh
+# database gets the current schema from create_all and every step is just
+# recorded as applied.
+def create_indexes(conn, *names):
+    for index in PaymentLink.__table__.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def add_keyset_index(conn):
+    create_indexes(conn, "ix_payment_links_created_at_id")
+
+
+def migrate_amounts_to_minor_units(conn):
+    """Move pre-existing rows from the float ``amount`` (USD) column to
+    integer ``amount_cents`` + ``currency``."""
+    columns = {c["name"] for c in inspect(conn).get_columns("payment_links")}
+    if "amount_cents" in columns:
+        return
+    conn.exec_driver_sql("ALTER TABLE payment_links ADD COLUMN amount_cents INTEGER")
+    conn.exec_driver_sql(
+        "ALTER TABLE payment_links ADD COLUMN currency VARCHAR NOT NULL DEFAULT 'usd'"
+    )
+    if "amount" in columns:
+        conn.exec_driver_sql(
+            "UPDATE payment_links SET amount_cents = CAST(ROUND(amount * 100) AS INTEGER)"
+        )
+
+
+def add_query_shape_indexes(conn):
+    create_indexes(
+        conn,
+        "ix_payment_links_order_id_status_created_at",
+        "ix_payment_links_status_created_at_id",
+    )
+    # Covered by the leftmost column of the order_id/status/created_at index.
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_payment_links_order_id")
+
+
+def add_live_order_unique_index(conn):
+    # Resolve races that already happened before enforcing uniqueness:
+    # pending links are expired when the order is paid or has a newer
+    # pending link, and extra paid links are flagged "paid_duplicate"
+    # (real payments that need a refund) rather than dropped.
+    conn.exec_driver_sql("""UPDATE payment_links SET status = 'expired'
+        WHERE status = 'pending' AND EXISTS (
+            SELECT 1 FROM payment_links other
+            WHERE other.order_id = payment_links.order_id
+            AND (other.status = 'paid'
+                 OR (other.status = 'pending' AND other.id > payment_links.id))
+        )""")
+    duplicates = conn.exec_driver_sql(
+        """UPDATE payment_links SET status = 'paid_duplicate'
+        WHERE status = 'paid' AND EXISTS (
+            SELECT 1 FROM payment_links other
+            WHERE other.order_id = payment_links.order_id
+            AND other.status = 'paid' AND other.id > payment_links.id
+        )"""
+    ).rowcount
+    if duplicates:
+        logger.warning(f"Flagged {duplicates} duplicate paid links as paid_duplicate.")
+    create_indexes(conn, "ux_payment_links_live_order_id")
+
+
+def add_expires_at(conn):
+    columns = {c["name"] for c in inspect(conn).get_columns("payment_links")}
+    if "expires_at" not in columns:
+        conn.exec_driver_sql(
+            "ALTER TABLE payment_links ADD COLUMN expires_at TIMESTAMP"
+        )
+        if conn.dialect.name == "sqlite":
+            # Keep SQLAlchemy's "YYYY-MM-DD HH:MM:SS.ffffff" storage format.
+            expiry = (
+                "strftime('%Y-%m-%d %H:%M:%S', created_at, '+{} seconds')"
+                " || substr(created_at, 20)"
+            )
+        else:
+            expiry = "created_at + interval '{} seconds'"
+        ttl = int(LINK_TTL.total_seconds())
+        conn.exec_driver_sql(
+            f"UPDATE payment_links SET expires_at = {expiry.format(ttl)}"
+        )
+    create_indexes(conn, "ix_payment_links_status_expires_at")
+
+
+MIGRATIONS = [
+    add_keyset_index,
+    migrate_amounts_to_minor_units,
+    add_query_shape_indexes,
+    add_live_order_unique_index,
+    add_expires_at,
+]
+
+
+# Every worker migrates from its lifespan; this lock makes workers that
+# start together take turns, so each later one finds the steps applied.
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", "60"))  # seconds
+MIGRATION_LOCK_KEY = 0x7061796C696E6B  # pg_advisory_xact_lock key
+
+
+def lock_migrations(conn):
+    """Take the migration lock, held until the transaction ends."""
+    dialect = conn.dialect.name
+    if dialect == "sqlite":
+        # The driver does not begin transactions before DDL, so start one
+        # that takes the write lock up front.
+        conn.exec_driver_sql(f"PRAGMA busy_timeout = {MIGRATION_LOCK_TIMEOUT * 1000}")
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif dialect == "postgresql":
+        conn.exec_driver_sql(f"SET LOCAL lock_timeout = '{MIGRATION_LOCK_TIMEOUT}s'")
+        conn.exec_driver_sql(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_KEY})")
+
+
+def run_migrations(conn):
+    fresh = not inspect(conn).has_table(PaymentLink.__tablename__)
+    Base.metadata.create_all(conn)
+    applied = set(conn.scalars(select(SchemaMigration.version)))
+    for version, migration in enumerate(MIGRATIONS, 1):
+        if version in applied:
+            continue
+        if not fresh:
+            migration(conn)
+            logger.info(f"Applied migration {version}: {migration.__name__}")
+        conn.execute(
+            insert(SchemaMigration).values(version=version, name=migration.__name__)
+        )
+
+
+async def init_db():
+    async with engine.connect() as conn:
+        try:
+            await conn.run_sync(lock_migrations)
+            await conn.run_sync(run_migrations)
+            await conn.run_sync(create_search_index)
+            await conn.commit()
+        finally:
+            if conn.dialect.name == "sqlite":
+                busy_timeout = SQLITE_PRAGMAS["busy_timeout"]
+                await conn.exec_driver_sql(f"PRAGMA busy_timeout = {busy_timeout}")
+
+
+def dialect_insert(model):
+    """INSERT supporting ON CONFLICT clauses on the configured database."""
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    return dialect.insert(model)
+
+
+def insert_pending_links():
+    """INSERT for new pending links that skips (ON CONFLICT DO NOTHING) any
+    order which already has a live link, relying on the partial unique index
+    rather than a check-then-insert."""
+    return dialect_insert(PaymentLink).on_conflict_do_nothing(
+        index_elements=[PaymentLink.order_id],
+        index_where=text(LIVE_LINK_PREDICATE),
+    )
+
+
+async def expire_stale_pending(db: AsyncSession, link_ids):
+    """Mark pending links past their 5 minutes as expired, freeing the
+    order for a new link. Returns their tokens for cache invalidation."""
+    result = await db.scalars(
+        update(PaymentLink)
+        .where(PaymentLink.id.in_(link_ids), PaymentLink.status == "pending")
+        .values(status="expired")
+        .returning(PaymentLink.token)
+    )
+    return list(result)
+
+
+def link_status(link, now=None) -> str:
+    """Status of a loaded link, with lazy expiry applied."""
+    if link.status == "pending" and link.expires_at < (now or datetime.now()):
+        return "expired"
+    return link.status
+
+
+def effective_status(now=None):
+    """SQL counterpart of link_status, for selecting the status column."""
+    expired = and_(
+        PaymentLink.status == "pending",
+        PaymentLink.expires_at < (now or datetime.now()),
+    )
+    return case((expired, "expired"), else_=PaymentLink.status)
+
+
+def status_filter(status, now=None):
+    """WHERE clause for links whose effective status is ``status``, written
+    so that the status indexes still apply."""
+    now = now or datetime.now()
+    if status == "pending":
+        return and_(PaymentLink.status == "pending", PaymentLink.expires_at >= now)
+    if status == "expired":
+        return (PaymentLink.status == "expired") | and_(
+            PaymentLink.status == "pending", PaymentLink.expires_at < now
+        )
+    return PaymentLink.status == status
+
+
+async def get_link_by_token(db: AsyncSession, token: str) -> Optional[PaymentLink]:
+    result = await db.execute(select(PaymentLink).where(PaymentLink.token == token))
+    return result.scalars().first()
+
+
+# Dependency to Get DB Session
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+# ---------------------------
+# Link Cache
+# ---------------------------
+# Read-through cache of payment links by token for the customer-facing
+# pages. Every status write invalidates the token after commit. The
+# in-memory cache only sees its own process's invalidations, so paths that
+# move money (create_checkout_session) bypass it unless the cache is shared.
+# A fill is only stored if the token was not invalidated while it was read
+# from the database (see LinkCache.version).
+class LinkSnapshot(NamedTuple):
+    id: int
+    token: str
+    order_id: str
+    email: str
+    amount_cents: int
+    currency: str
+    created_at: datetime
+    status: str
+    expires_at: datetime
+
+
+LINK_SNAPSHOT_COLUMNS = [getattr(PaymentLink, name) for name in LinkSnapshot._fields]
+
+
+class LinkCache(ABC):
+    shared = False  # True if invalidations are seen by every worker
+
+    @abstractmethod
+    async def get(self, token: str) -> Optional[LinkSnapshot]: ...
+
+    @abstractmethod
+    async def version(self, token: str):
+        """Opaque invalidation version of ``token``, taken before reading it
+        from the database."""
+
+    @abstractmethod
+    async def set(self, link: LinkSnapshot, version):
+        """Cache ``link`` unless its token was invalidated since ``version``."""
+
+    @abstractmethod
+    async def delete(self, *tokens: str): ...
+
+
+class NullLinkCache(LinkCache):
+    shared = True  # nothing cached, so nothing can be stale
+
+    async def get(self, token):
+        return None
+
+    async def version(self, token):
+        return None
+
+    async def set(self, link, version):
+        pass
+
+    async def delete(self, *tokens):
+        pass
+
+
+class InMemoryLinkCache(LinkCache):
+    """Per-process LRU with a TTL, bounded to ``max_entries`` links."""
+
+    def __init__(self, max_entries=10_000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # {token: (expires_at, LinkSnapshot)}
+        # Bumped by every invalidation: cheaper than per-token versions,
+        # at the cost of skipping fills that overlap any invalidation.
+        self.generation = 0
+
+    async def get(self, token):
+        entry = self.entries.get(token)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self.entries[token]
+            return None
+        self.entries.move_to_end(token)
+        return entry[1]
+
+    async def version(self, token):
+        return self.generation
+
+    async def set(self, link, version):
+        if version != self.generation:
+            return
+        self.entries[link.token] = (time.monotonic() + self.ttl, link)
+        self.entries.move_to_end(link.token)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete(self, *tokens):
+        if tokens:
+            self.generation += 1
+        for token in tokens:
+            self.entries.pop(token, None)
+
+
+class RedisLinkCache(LinkCache):
+    """Link cache shared by all workers through Redis.
+
+    Each invalidation increments a per-token version key that lives for
+    ``ttl`` seconds; fills WATCH it and are dropped if it changed.
+    """
+
+    shared = True
+
+    def __init__(self, url=None, client=None, ttl=60, prefix="link"):
+        if client is None:
+            import redis.asyncio as redis
+
+            client = redis.from_url(url)
+        self.redis = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    async def get(self, token):
+        raw = await self.redis.get(f"{self.prefix}:{token}")
+        if raw is None:
+            return None
+        fields = json.loads(raw)
+        if len(fields) != len(LinkSnapshot._fields):
+            return None  # written by an older version
+        fields[6] = datetime.fromisoformat(fields[6])  # created_at
+        fields[8] = datetime.fromisoformat(fields[8])  # expires_at
+        return LinkSnapshot(*fields)
+
+    async def version(self, token):
+        return int(await self.redis.get(f"{self.prefix}:{token}:v") or 0)
+
+    async def set(self, link, version):
+        from redis.exceptions import WatchError
+
+        raw = json.dumps(
+            [
+                *link[:6],
+                link.created_at.isoformat(),
+                link.status,
+                link.expires_at.isoformat(),
+            ]
+        )
+        key = f"{self.prefix}:{link.token}"
+        async with self.redis.pipeline() as pipe:
+            try:
+                await pipe.watch(f"{key}:v")
+                if int(await pipe.get(f"{key}:v") or 0) != version:
+                    return
+                pipe.multi()
+                pipe.set(key, raw, ex=self.ttl)
+                await pipe.execute()
+            except WatchError:
+                pass  # invalidated between the check and the write
+
+    async def delete(self, *tokens):
+        if not tokens:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for token in tokens:
+                key = f"{self.prefix}:{token}"
+                pipe.delete(key)
+                pipe.incr(f"{key}:v")
+                pipe.expire(f"{key}:v", self.ttl)
+            await pipe.execute()
+
+
+def link_cache_from_env() -> LinkCache:
+    if LINK_CACHE_BACKEND == "redis":
+        return RedisLinkCache(REDIS_URL, ttl=LINK_CACHE_TTL)
+    if LINK_CACHE_BACKEND == "memory":
+        return InMemoryLinkCache(LINK_CACHE_SIZE, ttl=LINK_CACHE_TTL)
+    return NullLinkCache()
+
+
+link_cache = link_cache_from_env()
+
+
+async def get_link_snapshot(
+    db: AsyncSession, token: str, fresh: bool = False
+) -> Optional[LinkSnapshot]:
+    """Payment link fields for ``token``, from the cache unless ``fresh``."""
+    if not fresh:
+        link = await link_cache.get(token)
+        if link is not None:
+            return link
+    version = await link_cache.version(token)
+    row = (
+        await db.execute(
+            select(*LINK_SNAPSHOT_COLUMNS).where(PaymentLink.token == token)
+        )
+    ).first()
+    if row is None:
+        return None
+    link = LinkSnapshot(*row)
+    await link_cache.set(link, version)
+    return link
+
+
+# ---------------------------
+# Idempotency Keys
+# ---------------------------
+async def claim_idempotency_key(db: AsyncSession, key: str, request_hash: str):
+    """Reserve ``key`` for this request, taking over an expired entry.
+
+    Returns None if the caller now owns the key, otherwise the existing
+    live entry.
+    """
+    now = datetime.now()
+    values = {
+        "key": key,
+        "request_hash": request_hash,
+        "status_code": None,
+        "response_body": None,
+        # Short lease while in flight, so a crashed request does not block
+        # retries for the whole TTL.
+        "expires_at": now + timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT),
+    }
+    stmt = dialect_insert(IdempotencyKey).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[IdempotencyKey.key],
+        set_={name: stmt.excluded[name] for name in values if name != "key"},
+        where=IdempotencyKey.expires_at <= now,
+    ).returning(IdempotencyKey.key)
+    claimed = await db.scalar(stmt)
+    await db.commit()
+    if claimed:
+        return None
+    return await db.get(IdempotencyKey, key)
+
+
+async def store_idempotent_response(db: AsyncSession, key: str, response):
+    # Server errors are not cached, so the client can retry them.
+    if response.status_code >= 500:
+        stmt = delete(IdempotencyKey).where(IdempotencyKey.key == key)
+    else:
+        stmt = (
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key == key)
+            .values(
+                status_code=response.status_code,
+                response_body=response.body,
+                expires_at=datetime.now() + timedelta(seconds=IDEMPOTENCY_KEY_TTL),
+            )
+        )
+    await db.execute(stmt)
+    await db.commit()
+
+
+async def sweep_idempotency_keys(batch_size=1000):
+    """Delete expired keys in batches, committing between them so the write
+    lock is never held for long."""
+    removed = 0
+    async with SessionLocal() as db:
+        while True:
+            expired = (
+                select(IdempotencyKey.key)
+                .where(IdempotencyKey.expires_at <= datetime.now())
+                .limit(batch_size)
+            )
+            result = await db.execute(
+                delete(IdempotencyKey).where(IdempotencyKey.key.in_(expired))
+            )
+            await db.commit()
+            removed += result.rowcount
+            if result.rowcount < batch_size:
+                return removed
+
+
+async def run_idempotency_sweeper(interval):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            removed = await sweep_idempotency_keys()
+            if removed:
+                logger.info(f"Evicted {removed} expired idempotency keys.")
+        except Exception:
+            logger.exception("Error sweeping idempotency keys.")
+
+
+# ---------------------------
+# Expiry Sweep
+# ---------------------------
+# Pending links read as expired once past expires_at (see link_status); the
+# sweep persists that status in id-range batches. One worker at a time runs
+# it, holding the "expiry_sweep" lease.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def acquire_lease(name: str, ttl: float, holder: str = WORKER_ID) -> bool:
+    """Take or renew the lease ``name`` for ``ttl`` seconds. False if another
+    holder's lease is still live."""
+    now = datetime.now()
+    values = {
+        "name": name,
+        "holder": holder,
+        "expires_at": now + timedelta(seconds=ttl),
+    }
+    stmt = dialect_insert(SchedulerLease).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SchedulerLease.name],
+        set_={"holder": holder, "expires_at": stmt.excluded.expires_at},
+        where=(SchedulerLease.holder == holder) | (SchedulerLease.expires_at <= now),
+    ).returning(SchedulerLease.name)
+    async with SessionLocal() as db:
+        acquired = await db.scalar(stmt)
+        await db.commit()
+    return acquired is not None
+
+
+async def expire_pending_links(batch_size=EXPIRY_BATCH_SIZE):
+    """Mark pending links past expires_at as expired, ``batch_size`` links
+    per transaction so the write lock is never held for long."""
+    started = time.perf_counter()
+    now = datetime.now()
+    due = and_(PaymentLink.status == "pending", PaymentLink.expires_at < now)
+    # Each batch seeks the first due links on the status/expires_at index;
+    # the ones it handles are no longer pending, so the next batch starts
+    # past them without a cursor.
+    next_batch = select(PaymentLink.id).where(due).limit(batch_size)
+    expired = batches = 0
+    async with SessionLocal() as db:
+        while True:
+            ids = list(await db.scalars(next_batch))
+            if not ids:
+                await db.commit()
+                break
+            # "status || ''" keeps SQLite on the primary key; with a plain
+            # status = 'pending' it walks the status index instead.
+            tokens = await db.scalars(
+                update(PaymentLink)
+                .where(PaymentLink.id.in_(ids), (PaymentLink.status + "") == "pending")
+                .values(status="expired")
+                .returning(PaymentLink.token)
+            )
+            tokens = list(tokens)
+            await db.commit()
+            await link_cache.delete(*tokens)
+            expired += len(tokens)
+            batches += 1
+            if len(ids) < batch_size:
+                break
+        duration_ms = round((time.perf_counter() - started) * 1000)
+        await db.execute(
+            update(SchedulerLease)
+            .where(SchedulerLease.name == "expiry_sweep")
+            .values(
+                last_run_at=now,
+                last_duration_ms=duration_ms,
+                last_rows_affected=expired,
+            )
+        )
+        await db.commit()
+    return {"expired": expired, "batches": batches, "duration_ms": duration_ms}
+
+
+async def run_expiry_scheduler(interval):
+    # The lease outlives one interval, so the holder keeps renewing it and
+    # another worker only takes over once the holder has stopped.
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if not await acquire_lease("expiry_sweep", ttl=interval * 2):
+                continue
+            stats = await expire_pending_links()
+            if stats["expired"]:
+                logger.info(
+                    f"Expired {stats['expired']} payment links "
+                    f"in {stats['duration_ms']} ms."
+                )
+        except Exception:
+            logger.exception("Error expiring payment links.")
+
+
+# ---------------------------
+# Stripe Gateway
+# ---------------------------
+class StripeGateway:
+    """Non-blocking wrapper around the Stripe calls made by the endpoints.
+
+    Requests go through the SDK's async (httpx) client, at most
+    ``max_concurrency`` at a time, and each call is bounded by ``timeout``
+    seconds including time spent waiting for a slot.
+    """
+
+    def __init__(self, api_key, max_concurrency=10, timeout=10.0, api_base=None):
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.client = stripe.StripeClient(
+            api_key,
+            base_addresses={"api": api_base} if api_base else {},
+            http_client=stripe.HTTPXClient(timeout=timeout),
+        )
+
+    async def _call(self, request):
+        """Run ``request()``, a zero-argument coroutine function. It is only
+        called once a slot is free, so a timeout while waiting leaves no
+        coroutine un-awaited."""
+
+        async def bounded():
+            async with self._semaphore:
+                return await request()
+
+        return await asyncio.wait_for(bounded(), self.timeout)
+
+    async def create_checkout_session(self, **params):
+        return await self._call(
+            lambda: self.client.checkout.sessions.create_async(params=params)
+        )
+
+
+stripe_gateway = StripeGateway(
+    STRIPE_SECRET_KEY,
+    max_concurrency=STRIPE_MAX_CONCURRENCY,
+    timeout=STRIPE_TIMEOUT,
+    api_base=STRIPE_API_BASE,
+)
 
 
 # ---------------------------
 # FastAPI App Setuo
 # ---------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    compile_templates()
+    render_static_pages()
+    render_service_worker()
+    tasks = [
+        asyncio.create_task(run_idempotency_sweeper(IDEMPOTENCY_SWEEP_INTERVAL)),
+        asyncio.create_task(run_expiry_scheduler(EXPIRY_SWEEP_INTERVAL)),
+    ]
+    if isinstance(rate_limit_backend, InMemoryRateLimitBackend):
+        tasks.append(asyncio.create_task(rate_limit_backend.run_sweeper()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await engine.dispose()
+
+
 app = FastAPI(
     title="Payment Links",
     description="A simple payment link service using FastAPI and Stripe",
     version="0.1.0",
     docs_url="/",
+    lifespan=lifespan,
 )
 
 
+class RateLimitBackend(ABC):
+    """Storage for rate limit counters, shared by all RateLimitMiddleware keys."""
+
+    @abstractmethod
+    async def hit(self, key: str, limit: int, window: int) -> bool:
+        """Record a request for ``key``; return False if it is over ``limit``."""
+
+
+class _WindowCounter:
+    __slots__ = ("index", "previous", "current", "expires_at")
+
+    def __init__(self, index, expires_at):
+        self.index = index
+        self.previous = 0
+        self.current = 0
+        self.expires_at = expires_at
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """Per-process sliding-window counter with constant cost per request.
+
+    Each key keeps only the previous and current fixed-window counts; the
+    estimate weights the previous window by how much of it still overlaps
+    the sliding window. Idle keys are dropped by ``sweep`` (run
+    periodically by ``run_sweeper``), and at most ``max_keys`` are kept,
+    evicting the least recently seen.
+    """
+
+    def __init__(self, max_keys=1_000_000):
+        self.max_keys = max_keys
+        self.counters = OrderedDict()  # {key: _WindowCounter}, LRU order
+
+    async def hit(self, key, limit, window):
+        now = time.time()
+        index = int(now // window)
+        counter = self.counters.get(key)
+        if counter is None:
+            if len(self.counters) >= self.max_keys:
+                self.counters.popitem(last=False)
+            counter = self.counters[key] = _WindowCounter(index, 0)
+        else:
+            self.counters.move_to_end(key)
+        if counter.index != index:
+            counter.previous = counter.current if counter.index == index - 1 else 0
+            counter.current = 0
+            counter.index = index
+
+        counter.expires_at = now + 2 * window
+        if counter.previous * (1 - (now / window - index)) + counter.current < limit:
+            counter.current += 1
+            return True
+        return False
+
+    async def sweep(self, chunk_size=10_000):
+        """Drop keys whose counters have expired, yielding between chunks."""
+        now = time.time()
+        keys = list(self.counters)
+        removed = 0
+        for start in range(0, len(keys), chunk_size):
+            for key in keys[start : start + chunk_size]:
+                counter = self.counters.get(key)
+                if counter is not None and counter.expires_at <= now:
+                    del self.counters[key]
+                    removed += 1
+            await asyncio.sleep(0)
+        return removed
+
+    async def run_sweeper(self, interval=60):
+        while True:
+            await asyncio.sleep(interval)
+            removed = await self.sweep()
+            if removed:
+                logger.info(f"Rate limiter evicted {removed} idle clients.")
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """Sliding-window counter shared by all workers through Redis.
+
+    Works with any Redis-compatible server (or ``fakeredis`` in tests).
+    """
+
+    def __init__(self, url=None, client=None, prefix="ratelimit"):
+        if client is None:
+            import redis.asyncio as redis
+
+            client = redis.from_url(url)
+        self.redis = client
+        self.prefix = prefix
+
+    async def hit(self, key, limit, window):
+        now = time.time()
+        index = int(now // window)
+        current_key = f"{self.prefix}:{key}:{index}"
+        previous_key = f"{self.prefix}:{key}:{index - 1}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.incr(current_key)
+            pipe.expire(current_key, 2 * window)
+            pipe.get(previous_key)
+            current, _, previous = await pipe.execute()
+
+        overlap = 1 - (now / window - index)
+        if int(previous or 0) * overlap + current - 1 < limit:
+            return True
+        # Rejected requests do not count against the window.
+        await self.redis.decr(current_key)
+        return False
+
+
+def rate_limit_backend_from_env() -> RateLimitBackend:
+    if RATE_LIMIT_BACKEND == "redis":
+        return RedisRateLimitBackend(REDIS_URL)
+    return InMemoryRateLimitBackend()
+
+
+rate_limit_backend = rate_limit_backend_from_env()
+
+
+class RateLimitPolicy(NamedTuple):
+    limit: int
+    window: int  # seconds
+
+
+# Route prefix -> policy; None exempts the prefix. Prefixes match on path
+# segment boundaries and the longest one wins; "/" is the default.
+RATE_LIMIT_POLICIES = {
+    "/": RateLimitPolicy(10, 60),
+    "/pay": RateLimitPolicy(30, 60),
+    "/create_checkout_session": RateLimitPolicy(10, 60),
+    "/create_payment_link": RateLimitPolicy(600, 60),
+    "/create_payment_links": RateLimitPolicy(60, 60),
+    "/static": None,
+    "/sw.js": None,
+    "/pages": None,
+    # Stripe redirect targets, hit once per checkout.
+    "/payment_success": None,
+    "/payment_cancelled": None,
+    "/stripe/webhook": None,
+}
+
+
+class RoutePolicyMatcher:
+    """Longest-prefix lookup over a policy table, one dict probe per segment."""
+
+    def __init__(self, policies, default=None):
+        self.policies = {
+            prefix.rstrip("/") or "/": policy for prefix, policy in policies.items()
+        }
+        self.default = self.policies.pop("/", default)
+
+    def match(self, path):
+        prefix = path.rstrip("/")
+        while prefix:
+            if prefix in self.policies:
+                return self.policies[prefix]
+            prefix = prefix[: prefix.rfind("/")]
+        return self.default
+
+
 class RateLimitMiddleware:
-    def __init__(self, app, rate_limit=10, time_window=60):
+    def __init__(self, app, rate_limit=10, time_window=60, backend=None, policies=None):
         self.app = app
         self.rate_limit = rate_limit
         self.time_window = time_window
-        self.client_requests = {}  # {client_ip: [timestamps]}
+        self.backend = backend or InMemoryRateLimitBackend()
+        self.matcher = RoutePolicyMatcher(
+            policies or {}, default=RateLimitPolicy(rate_limit, time_window)
+        )
 
     async def __call__(self, scope, receive, send):
         if scope["type"] != "http":
             await self.app(scope, receive, send)
             return
 
-        client_ip = scope.get("client")[0]
-        now = time.time()
-        self.client_requests.setdefault(client_ip, [])
-        # Remove outdated timestamps
-        self.client_requests[client_ip] = [
-            ts for ts in self.client_requests[client_ip] if now - ts < self.time_window
-        ]
+        path = scope["path"]
+        policy = self.matcher.match(path)
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
 
-        if len(self.client_requests[client_ip]) >= self.rate_limit:
+        client_ip = scope.get("client")[0]
+        # Limit per IP and per route, keyed on the first path segment so
+        # that e.g. every /pay/{token} shares one budget.
+        route = "/" + path.lstrip("/").split("/", 1)[0]
+        allowed = await self.backend.hit(
+            f"{client_ip}:{route}", policy.limit, policy.window
+        )
+        if not allowed:
             response = JSONResponse({"detail": "Rate limit exceeded"}, status_code=429)
             await response(scope, receive, send)
             return
 
-        self.client_requests[client_ip].append(now)
         await self.app(scope, receive, send)
 
 
+# ---------------------------
+# Static Assets
+# ---------------------------
+# Built by build_assets.py: content-hashed files under /static, served as
+# immutable, and each template's critical CSS, inlined into its <style>
+# tag and allowed by hash in the CSP.
+ASSET_MANIFEST_PATH = "static/manifest.json"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def load_asset_manifest(path=ASSET_MANIFEST_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.warning(f"{path} not found, run build_assets.py.")
+        return {"files": {}, "critical_css": {}}
+
+
+asset_manifest = load_asset_manifest()
+
+
+def asset_url(path: str) -> str:
+    """URL of the fingerprinted build of the static file ``path``."""
+    return "/static/" + asset_manifest["files"].get(path, path)
+
+
+@pass_context
+def critical_css(context) -> Markup:
+    """Critical CSS for the template being rendered."""
+    return Markup(asset_manifest["critical_css"].get(context.name, ""))
+
+
+def critical_css_hashes() -> str:
+    """CSP sources allowing exactly the inlined critical CSS."""
+    digests = (
+        hashlib.sha256(css.encode("utf-8")).digest()
+        for css in sorted(set(asset_manifest["critical_css"].values()))
+    )
+    return " ".join(f"'sha256-{base64.b64encode(d).decode()}'" for d in digests)
+
+
+# Cache-Control for other files under /static, by path prefix (the
+# longest match wins). Unversioned files are revalidated, cheaply thanks to
+# StaticFiles' ETag/Last-Modified handling.
+STATIC_CACHE_CONTROL = {
+    "": "public, max-age=3600",
+    "js/": "public, max-age=3600, must-revalidate",
+    "manifest.json": "no-cache",
+}
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles with per-path Cache-Control; fingerprinted files are
+    cached forever."""
+
+    def __init__(self, *args, immutable=(), cache_control=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.immutable = frozenset(immutable)
+        cache_control = STATIC_CACHE_CONTROL if cache_control is None else cache_control
+        self.cache_control = sorted(
+            cache_control.items(), key=lambda item: len(item[0]), reverse=True
+        )
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        path = self.get_path(scope).replace(os.sep, "/")
+        if path in self.immutable:
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        else:
+            for prefix, value in self.cache_control:
+                if path.startswith(prefix):
+                    response.headers["Cache-Control"] = value
+                    break
+        return response
+
+
+# The app's pages only use same-origin assets and their hashed inline CSS.
+CSP_DIRECTIVES = {
+    "default-src": "'self'",
+    "script-src": "'self'",
+    "style-src": f"'self' {critical_css_hashes()}".strip(),
+    "img-src": "'self' data:",
+    "object-src": "'none'",
+    "base-uri": "'self'",
+    "frame-ancestors": "'none'",
+}
+# The API docs (Swagger UI, ReDoc) load from a CDN and run inline scripts.
+DOCS_CSP_DIRECTIVES = {
+    "default-src": "'self'",
+    "script-src": "'self' 'unsafe-inline' 'unsafe-eval' https://cdn.jsdelivr.net",
+    "style-src": "'self' 'unsafe-inline' https://cdn.jsdelivr.net",
+    "font-src": "'self' data:",
+    "img-src": "'self' data: https://fastapi.tiangolo.com",
+}
+SECURITY_HEADERS = {
+    "Strict-Transport-Security": "max-age=63072000; includeSubDomains",
+    "X-Content-Type-Options": "nosniff",
+    "Referrer-Policy": "strict-origin-when-cross-origin",
+}
+# Opt-in per-request script nonces, exposed to templates as
+# request.state.csp_nonce.
+CSP_NONCE = os.getenv("CSP_NONCE", "false").lower() == "true"
+
+
 class ContentSecurityPolicyMiddleware:
-    def __init__(self, app):
+    """Adds the CSP and other security headers to every HTTP response.
+
+    Header bytes are built once here. ``path_directives`` gives exact paths
+    their own policy, sent unchanged. With ``use_nonce`` the default
+    script-src drops 'unsafe-inline'/'unsafe-eval' in favour of a fresh
+    nonce, which is the only part assembled per request.
+    """
+
+    def __init__(
+        self, app, directives=None, headers=None, use_nonce=False, path_directives=None
+    ):
         self.app = app
+        self.use_nonce = use_nonce
+        headers = SECURITY_HEADERS if headers is None else headers
+        self.extra_headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers.items()
+        ]
+        # The policy is head + nonce + tail.
+        self.csp_head, self.csp_tail = self.build_csp(
+            CSP_DIRECTIVES if directives is None else directives, use_nonce
+        )
+        self.headers = [
+            (b"content-security-policy", self.csp_head)
+        ] + self.extra_headers
+        # No nonce here: the API docs' inline scripts do not carry one.
+        self.path_headers = {
+            path: [(b"content-security-policy", self.build_csp(policy)[0])]
+            + self.extra_headers
+            for path, policy in (path_directives or {}).items()
+        }
+
+    @staticmethod
+    def build_csp(directives, use_nonce=False):
+        directives = dict(directives)
+        if use_nonce:
+            sources = directives.get("script-src", "'self'").split()
+            sources = [
+                s for s in sources if s not in ("'unsafe-inline'", "'unsafe-eval'")
+            ]
+            directives["script-src"] = " ".join(sources) + " 'nonce-{nonce}'"
+        csp = "; ".join(f"{name} {value}" for name, value in directives.items()) + ";"
+        head, _, tail = csp.encode("latin-1").partition(b"{nonce}")
+        return head, tail
 
     async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = self.path_headers.get(scope["path"])
+        if headers is None:
+            headers = self.headers
+            if self.use_nonce:
+                nonce = secrets.token_urlsafe(16)
+                scope.setdefault("state", {})["csp_nonce"] = nonce
+                csp = self.csp_head + nonce.encode("ascii") + self.csp_tail
+                headers = [(b"content-security-policy", csp)] + self.extra_headers
+
+        # A closure is cheaper to create than any send wrapper object.
         async def send_wrapper(message):
             if message["type"] == "http.response.start":
-                csp = (
-                    "default-src 'self'; "
-                    "script-src 'self' 'unsafe-inline' 'unsafe-eval' https://cdn.jsdelivr.net; "
-                    "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net; "
-                    "font-src 'self' data:; "
-                    "img-src 'self' data: https://fastapi.tiangolo.com;"
-                )
-                message.setdefault("headers", [])
-                message["headers"].append(
-                    (b"content-security-policy", csp.encode("utf-8"))
-                )
-
+                message.setdefault("headers", []).extend(headers)
             await send(message)
 
         await self.app(scope, receive, send_wrapper)
 
 
-app.add_middleware(RateLimitMiddleware, rate_limit=10, time_window=60)
-app.add_middleware(ContentSecurityPolicyMiddleware)
+# ---------------------------
+# Compression
+# ---------------------------
+# Content types worth compressing; images, fonts and already-compressed
+# downloads are sent as-is.
+COMPRESSIBLE_TYPES = frozenset(
+    {
+        "text/html",
+        "text/css",
+        "text/csv",
+        "text/plain",
+        "text/javascript",
+        "application/javascript",
+        "application/json",
+        "application/x-ndjson",
+        "application/xml",
+        "image/svg+xml",
+    }
+)
+# Complete bodies smaller than this are not worth the CPU or the header.
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "500"))
+
+
+def accepted_encodings(header: str) -> set:
+    """Content codings the client accepts (q > 0) from Accept-Encoding."""
+    codings = set()
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip().removeprefix("q=")
+        try:
+            if q and float(q) <= 0:
+                continue
+        except ValueError:
+            continue
+        codings.add(coding.strip().lower())
+    return codings
+
+
+class StreamCompressor:
+    """Incremental br/gzip encoder. Every chunk is flushed, so a streamed
+    response (NDJSON, CSV) reaches the client as it is produced."""
+
+    def __init__(self, encoding, gzip_level=6, brotli_quality=4):
+        if encoding == "br":
+            self.brotli = brotli.Compressor(quality=brotli_quality)
+        else:
+            self.brotli = None
+            self.zlib = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        if self.brotli is not None:
+            out = self.brotli.process(data)
+            return out + (self.brotli.finish() if final else self.brotli.flush())
+        out = self.zlib.compress(data)
+        return out + self.zlib.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class CompressionMiddleware:
+    """Compresses responses with br (if brotli is installed) or gzip, as the
+    client accepts.
+
+    Only ``content_types`` are compressed, and never responses that already
+    have a Content-Encoding (pre-compressed pages, gzip exports). Complete
+    bodies under ``minimum_size`` bytes are sent as-is; streamed bodies are
+    always compressed, chunk by chunk.
+    """
+
+    def __init__(
+        self,
+        app,
+        minimum_size=COMPRESSION_MIN_SIZE,
+        content_types=COMPRESSIBLE_TYPES,
+        gzip_level=6,
+        brotli_quality=4,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.content_types = frozenset(content_types)
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        codings = accepted_encodings(accept)
+        encoding = next(
+            (c for c in ("br", "gzip") if c in codings and (c != "br" or brotli)),
+            None,
+        )
+        start = None  # response start held until the first body chunk
+        compressor = None
 
-templates = Jinja2Templates(directory="templates")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+        async def send_wrapper(message):
+            nonlocal start, compressor
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                content_type = headers.get("content-type", "").partition(";")[0]
+                if (
+                    content_type.strip() not in self.content_types
+                    or "content-encoding" in headers
+                    or message["status"] in (204, 206, 304)
+                ):
+                    await send(message)
+                    return
+                if "accept-encoding" not in headers.get("vary", "").lower():
+                    headers.add_vary_header("Accept-Encoding")
+                if encoding is None:
+                    await send(message)
+                else:
+                    start = message
+                return
+
+            if message["type"] != "http.response.body" or (
+                start is None and compressor is None
+            ):
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(scope=start)
+                if not more_body and len(body) < self.minimum_size:
+                    await send(start)
+                    await send(message)
+                    start = None
+                    return
+                compressor = StreamCompressor(
+                    encoding, self.gzip_level, self.brotli_quality
+                )
+                headers["Content-Encoding"] = encoding
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = "W/" + etag  # no longer byte-identical
+                body = compressor.compress(body, final=not more_body)
+                if more_body:
+                    del headers["Content-Length"]
+                else:
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                start = None
+            else:
+                body = compressor.compress(body, final=not more_body)
+            await send(
+                {"type": "http.response.body", "body": body, "more_body": more_body}
+            )
+
+        await self.app(scope, receive, send_wrapper)
+
+
+app.add_middleware(
+    RateLimitMiddleware,
+    rate_limit=10,
+    time_window=60,
+    backend=rate_limit_backend,
+    policies=RATE_LIMIT_POLICIES,
+)
+app.add_middleware(
+    ContentSecurityPolicyMiddleware,
+    use_nonce=CSP_NONCE,
+    path_directives={
+        path: DOCS_CSP_DIRECTIVES
+        for path in (app.docs_url, app.redoc_url, app.swagger_ui_oauth2_redirect_url)
+        if path
+    },
+)
+app.add_middleware(CompressionMiddleware)
+app.mount(
+    "/static",
+    AssetFiles(directory="static", immutable=asset_manifest["files"].values()),
+    name="static",
+)
+
+
+# ---------------------------
+# Templates
+# ---------------------------
+if TEMPLATE_CACHE_DIR:
+    os.makedirs(TEMPLATE_CACHE_DIR, exist_ok=True)
+template_env = Environment(
+    loader=FileSystemLoader("templates"),
+    autoescape=True,
+    auto_reload=TEMPLATE_AUTO_RELOAD,
+    bytecode_cache=FileSystemBytecodeCache(TEMPLATE_CACHE_DIR),
+)
+template_env.globals.update(asset_url=asset_url, critical_css=critical_css)
+templates = Jinja2Templates(env=template_env)
+
+
+def compile_templates():
+    """Load every template into the environment's cache at startup, so no
+    request pays for parsing and compiling one."""
+    for name in template_env.list_templates(extensions=["html"]):
+        template_env.get_template(name)
+
+
+class StaticPage:
+    """A page whose content never changes, rendered once and kept as
+    identity, gzip and (with brotli installed) br bytes, each with a strong
+    ETag."""
+
+    def __init__(self, content: str, media_type: str = "text/html"):
+        self.media_type = media_type
+        body = content.encode("utf-8")
+        etag = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {None: (body, f'"{etag}"')}
+        self.variants["gzip"] = (gzip.compress(body, 9, mtime=0), f'"{etag}-gz"')
+        if brotli is not None:
+            self.variants["br"] = (brotli.compress(body), f'"{etag}-br"')
+
+    def response(self, request: Request) -> Response:
+        codings = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next(
+            (c for c in ("br", "gzip") if c in self.variants and c in codings), None
+        )
+        body, etag = self.variants[encoding]
+        # Revalidated on every view: the page shown for a token can change.
+        headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match", "")
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or etag in tags:
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+# Status pages that only ever show a fixed message: {name: (template, message)}
+STATIC_PAGES = {
+    "paid": ("paid.html", "Payment has already been made."),
+    "expired": ("expired.html", "This payment link has expired."),
+    "success": ("payment_success.html", "Payment successful!"),
+    "success_pending": (
+        "payment_success.html",
+        "Payment received. Confirmation is on its way.",
+    ),
+    "cancelled": ("payment_cancelled.html", "Payment was cancelled."),
+    "offline": ("offline.html", "Reconnect to continue with your payment."),
+}
+static_pages = {}  # {name: StaticPage}, built at startup
+# Shells the service worker shows for these pages while offline, see
+# templates/sw.js.
+OFFLINE_PAGES = ("offline", "success_pending", "cancelled")
+service_worker = None  # StaticPage for /sw.js, built at startup
+
+
+def render_static_pages():
+    for name, (template, message) in STATIC_PAGES.items():
+        html = template_env.get_template(template).render(message=message)
+        static_pages[name] = StaticPage(html)
+
+
+def render_service_worker():
+    """Fill templates/sw.js with the URLs to precache and a cache version that
+    changes whenever any of them does."""
+    global service_worker
+    versions = {asset_url(path): path for path in asset_manifest["files"]}
+    for name in OFFLINE_PAGES:
+        versions[f"/pages/{name}"] = static_pages[name].variants[None][1]
+    version = hashlib.sha256(
+        json.dumps(versions, sort_keys=True).encode("utf-8")
+    ).hexdigest()[:12]
+    with open("templates/sw.js", encoding="utf-8") as f:
+        script = f.read()
+    script = script.replace("__CACHE_VERSION__", version)
+    script = script.replace("__PRECACHE_URLS__", json.dumps(sorted(versions)))
+    service_worker = StaticPage(script, media_type="application/javascript")
+
+
+# ---------------------------
+# Money
+# ---------------------------
+# Amounts are stored as integers in the currency's minor unit (cents for
+# USD). These currencies have no minor unit and are stored as-is.
+ZERO_DECIMAL_CURRENCIES = frozenset(
+    "bif clp djf gnf jpy kmf krw mga pyg rwf ugx vnd vuv xaf xof xpf".split()
+)
+# These have three decimals (1 BHD = 1000 fils).
+THREE_DECIMAL_CURRENCIES = frozenset("bhd jod kwd omr tnd".split())
+
+
+def currency_exponent(currency: str) -> int:
+    if currency in ZERO_DECIMAL_CURRENCIES:
+        return 0
+    if currency in THREE_DECIMAL_CURRENCIES:
+        return 3
+    return 2
+
+
+def to_minor_units(amount: Decimal, currency: str) -> int:
+    """19.99 USD -> 1999. Exact; the amount must not have extra decimals."""
+    return int(amount.scaleb(currency_exponent(currency)))
+
+
+def format_amount(amount_cents: int, currency: str) -> str:
+    """1999 USD -> "19.99", without going through float."""
+    exponent = currency_exponent(currency)
+    if not exponent:
+        return str(amount_cents)
+    units, fraction = divmod(amount_cents, 10**exponent)
+    return f"{units}.{fraction:0{exponent}d}"
 
 
 # ---------------------------
@@ -153,6 +1745,7 @@ class PaymentLinkCreate(BaseModel):
     order_id: str
     email: EmailStr
     amount: Annotated[Decimal, Field(gt=0)]
+    currency: str = "usd"
 
     @field_validator("order_id")
     def order_id_not_empty(cls, v):
@@ -160,6 +1753,29 @@ class PaymentLinkCreate(BaseModel):
             raise ValueError("order_id cannot be empty")
         return v
 
+    @field_validator("currency")
+    def currency_code(cls, v):
+        v = v.lower()
+        if len(v) != 3 or not v.isalpha():
+            raise ValueError("currency must be a 3-letter ISO code")
+        return v
+
+    @model_validator(mode="after")
+    def amount_fits_currency(self):
+        exponent = currency_exponent(self.currency)
+        if self.amount.scaleb(exponent) % 1:
+            raise ValueError(
+                f"amount has more than {exponent} decimal places for {self.currency}"
+            )
+        # Stripe only accepts three-decimal amounts ending in 0.
+        if exponent == 3 and self.amount_cents % 10:
+            raise ValueError(f"amount must be a multiple of 0.01 for {self.currency}")
+        return self
+
+    @property
+    def amount_cents(self) -> int:
+        return to_minor_units(self.amount, self.currency)
+
 
 # ---------------------------
 # Endpoints
@@ -167,37 +1783,113 @@ class PaymentLinkCreate(BaseModel):
 
 
 @app.get("/sw.js", include_in_schema=False)
-async def service_worker():
-    return FileResponse("static/sw.js", media_type="application/javascript")
+async def service_worker_script(request: Request):
+    return service_worker.response(request)
+
+
+@app.get("/pages/{name}", response_class=HTMLResponse, include_in_schema=False)
+async def offline_page(request: Request, name: str):
+    """Page shells precached by the service worker."""
+    if name not in OFFLINE_PAGES:
+        return JSONResponse({"content": "Not found"}, status_code=404)
+    return static_pages[name].response(request)
 
 
 @app.post("/create_payment_link")
-async def create_payment_link(data: PaymentLinkCreate, db: Session = Depends(get_db)):
-    try:
-        payment_link = (
-            db.query(PaymentLink)
-            .filter(
-                PaymentLink.order_id == data.order_id,
-                PaymentLink.status.in_(("pending", "paid")),
+async def create_payment_link(
+    data: PaymentLinkCreate,
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Annotated[Optional[str], Header(max_length=255)] = None,
+):
+    """Create a payment link for an order, or return its live link.
+
+    With an ``Idempotency-Key`` header the first response is stored for
+    ``IDEMPOTENCY_KEY_TTL`` seconds and replayed byte for byte on retries
+    with the same key and body.
+    """
+    if not idempotency_key:
+        return await create_or_get_payment_link(data, db)
+
+    request_hash = hashlib.sha256(data.model_dump_json().encode()).hexdigest()
+    entry = await claim_idempotency_key(db, idempotency_key, request_hash)
+    if entry is not None:
+        if entry.request_hash != request_hash:
+            return JSONResponse(
+                {"content": "Idempotency-Key was used with a different request."},
+                status_code=422,
             )
-            .first()
+        if entry.status_code is None:
+            return JSONResponse(
+                {"content": "A request with this Idempotency-Key is in progress."},
+                status_code=409,
+            )
+        return Response(
+            content=entry.response_body,
+            status_code=entry.status_code,
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"},
         )
-        if payment_link:
+
+    response = await create_or_get_payment_link(data, db)
+    await store_idempotent_response(db, idempotency_key, response)
+    return response
+
+
+async def create_or_get_payment_link(data: PaymentLinkCreate, db: AsyncSession):
+    try:
+        now = datetime.now()
+        values = {
+            "token": uuid.uuid4().hex,
+            "order_id": data.order_id,
+            "email": data.email,
+            "amount_cents": data.amount_cents,
+            "currency": data.currency,
+            "created_at": now,
+            "expires_at": now + LINK_TTL,
+            "status": "pending",
+        }
+        # Usually a single INSERT. On conflict, the live link is read back;
+        # a stale pending one is expired and the insert retried.
+        expired_tokens = []
+        for _ in range(3):
+            token = await db.scalar(
+                insert_pending_links().values(values).returning(PaymentLink.token)
+            )
+            if token:
+                await db.commit()
+                await link_cache.delete(*expired_tokens)
+                logger.info(f"Payment link created: {token}")
+                return JSONResponse(
+                    {
+                        "payment_url": f"{MY_DOMAIN}/pay/{token}",
+                        "message": "Payment link created",
+                        "status": "success",
+                    }
+                )
+
+            result = await db.execute(
+                select(PaymentLink).where(
+                    PaymentLink.order_id == data.order_id,
+                    PaymentLink.status.in_(("pending", "paid")),
+                )
+            )
+            payment_link = result.scalars().first()
+            if payment_link is None:
+                continue
             if payment_link.status == "paid":
+                await db.commit()
+                await link_cache.delete(*expired_tokens)
                 return JSONResponse(
                     {
                         "message": "Order has already been paid.",
                         "status": "success",
                     }
                 )
-            elif (
-                payment_link.status == "pending"
-                and (payment_link.created_at + timedelta(minutes=5)) > datetime.now()
-            ):
+            if payment_link.expires_at >= now:
+                await db.commit()
+                await link_cache.delete(*expired_tokens)
                 payment_url = f"{MY_DOMAIN}/pay/{payment_link.token}"
-                remaining = (
-                    payment_link.created_at + timedelta(minutes=5) - datetime.now()
-                )
+                remaining = payment_link.expires_at - now
                 return JSONResponse(
                     {
                         "payment_url": payment_url,
@@ -205,30 +1897,11 @@ async def create_payment_link(data: PaymentLinkCreate, db: Session = Depends(get
                         "status": "success",
                     }
                 )
+            expired_tokens += await expire_stale_pending(db, [payment_link.id])
 
-        token = uuid.uuid4().hex
-        payment_link = PaymentLink(
-            token=token,
-            order_id=data.order_id,
-            email=data.email,
-            amount=float(data.amount),
-            created_at=datetime.now(),
-            status="pending",
-        )
-        db.add(payment_link)
-        db.commit()
-        db.refresh(payment_link)
-        payment_url = f"{MY_DOMAIN}/pay/{payment_link.token}"
-        logger.info(f"Payment link created: {payment_link.token}")
-        return JSONResponse(
-            {
-                "payment_url": payment_url,
-                "message": "Payment link created",
-                "status": "success",
-            }
-        )
+        raise RuntimeError("order is being modified concurrently, retry")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.exception("Error creating payment link.")
         return JSONResponse(
             {"content": f"Error creating payment link: {e}"},
@@ -236,34 +1909,186 @@ async def create_payment_link(data: PaymentLinkCreate, db: Session = Depends(get
         )
 
 
-@app.get("/pay/{token}", response_class=HTMLResponse, include_in_schema=False)
-async def pay_page(request: Request, token: str, db: Session = Depends(get_db)):
+def parse_bulk_item(item):
+    """Return a PaymentLinkCreate, or an error message for an invalid item."""
     try:
-        payment_link = db.query(PaymentLink).filter(PaymentLink.token == token).first()
-        if not payment_link:
-            return JSONResponse({"content": "Invalid payment link"}, status_code=404)
+        if isinstance(item, bytes):
+            return PaymentLinkCreate.model_validate_json(item)
+        return PaymentLinkCreate.model_validate(item)
+    except ValidationError as e:
+        return "; ".join(
+            f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}"
+            for err in e.errors()
+        )
 
-        # Check expiration: If more than 5 minutes passed, mark as expired.
-        if datetime.now() > payment_link.created_at + timedelta(minutes=5):
-            if payment_link.status not in ("paid", "expired"):
-                payment_link.status = "expired"
-                db.commit()
-                logger.info(f"Payment link expired: {payment_link.token}")
 
-        if payment_link.status == "paid":
-            return templates.TemplateResponse(
-                "paid.html",
-                {"request": request, "message": "Payment has already been made."},
+async def find_live_links(db: AsyncSession, order_ids):
+    """{order_id: (id, token, status, expires_at)} of pending/paid links."""
+    rows = await db.execute(
+        select(
+            PaymentLink.order_id,
+            PaymentLink.id,
+            PaymentLink.token,
+            PaymentLink.status,
+            PaymentLink.expires_at,
+        ).where(
+            PaymentLink.order_id.in_(order_ids),
+            PaymentLink.status.in_(("pending", "paid")),
+        )
+    )
+    return {order_id: tuple(link) for order_id, *link in rows}
+
+
+def describe_live_link(result, link):
+    _, token, status, _ = link
+    if status == "paid":
+        result["message"] = "Order has already been paid."
+    else:
+        result["payment_url"] = f"{MY_DOMAIN}/pay/{token}"
+        result["message"] = "Pending payment link already exists."
+
+
+async def create_payment_links_chunk(db: AsyncSession, items):
+    """Create links for ``[(index, PaymentLinkCreate | error), ...]`` in one
+    transaction: one query to find existing pending/paid links and one
+    executemany INSERT for the new ones."""
+    order_ids = {data.order_id for _, data in items if not isinstance(data, str)}
+    existing = await find_live_links(db, order_ids) if order_ids else {}
+
+    now = datetime.now()
+    stale_ids = []
+    new_links = {}  # {order_id: row}
+    results = []
+    for index, data in items:
+        if isinstance(data, str):
+            results.append({"index": index, "status": "error", "message": data})
+            continue
+
+        result = {"index": index, "order_id": data.order_id, "status": "success"}
+        link = existing.get(data.order_id)
+        if link and (link[2] == "paid" or link[3] >= now):
+            describe_live_link(result, link)
+        elif data.order_id in new_links:
+            # Repeated within this request: reuse the link created above.
+            result["payment_url"] = (
+                f"{MY_DOMAIN}/pay/{new_links[data.order_id]['token']}"
             )
-        if payment_link.status == "expired":
-            return templates.TemplateResponse(
-                "expired.html",
-                {"request": request, "message": "This payment link has expired."},
+            result["message"] = "Pending payment link already exists."
+        else:
+            if link:
+                stale_ids.append(link[0])
+            token = uuid.uuid4().hex
+            new_links[data.order_id] = {
+                "token": token,
+                "order_id": data.order_id,
+                "email": data.email,
+                "amount_cents": data.amount_cents,
+                "currency": data.currency,
+                "created_at": now,
+                "expires_at": now + LINK_TTL,
+                "status": "pending",
+            }
+            result["payment_url"] = f"{MY_DOMAIN}/pay/{token}"
+            result["message"] = "Payment link created"
+        results.append(result)
+
+    expired_tokens = await expire_stale_pending(db, stale_ids) if stale_ids else []
+    if new_links:
+        inserted = await db.scalars(
+            insert_pending_links().returning(PaymentLink.order_id),
+            list(new_links.values()),
+        )
+        # Orders that got a live link concurrently since the lookup above.
+        lost = set(new_links) - set(inserted)
+        if lost:
+            winners = await find_live_links(db, lost)
+            for result in results:
+                if result.get("order_id") in lost:
+                    result.pop("payment_url", None)
+                    if result["order_id"] in winners:
+                        describe_live_link(result, winners[result["order_id"]])
+                    else:
+                        result["status"] = "error"
+                        result["message"] = "Order was modified concurrently, retry."
+    await db.commit()
+    await link_cache.delete(*expired_tokens)
+    return results
+
+
+@app.post("/create_payment_links/bulk")
+async def create_payment_links_bulk(request: Request):
+    """Create many payment links at once.
+
+    Accepts a JSON array of payment links, or an NDJSON stream with
+    ``Content-Type: application/x-ndjson``. Items are processed in chunks
+    of ``BULK_CHUNK_SIZE`` and one NDJSON result per item is streamed back
+    in input order.
+    """
+    # The body is read up front: StreamingResponse also consumes receive()
+    # while it streams, so the request cannot be read concurrently.
+    if "ndjson" in request.headers.get("content-type", ""):
+        body = await request.body()
+        items = [line for line in body.split(b"\n") if line.strip()]
+    else:
+        try:
+            items = await request.json()
+        except ValueError:
+            return JSONResponse({"content": "Invalid JSON body"}, status_code=400)
+        if not isinstance(items, list):
+            return JSONResponse(
+                {"content": "Expected a JSON array of payment links"},
+                status_code=400,
             )
 
+    async def process(db, chunk):
+        try:
+            results = await create_payment_links_chunk(db, chunk)
+        except Exception as e:
+            await db.rollback()
+            logger.exception("Error creating payment links chunk.")
+            results = [
+                {"index": index, "status": "error", "message": str(e)}
+                for index, _ in chunk
+            ]
+        return "".join(json.dumps(result) + "\n" for result in results)
+
+    async def stream_results():
+        async with SessionLocal() as db:
+            for start in range(0, len(items), BULK_CHUNK_SIZE):
+                chunk = [
+                    (index, parse_bulk_item(item))
+                    for index, item in enumerate(
+                        items[start : start + BULK_CHUNK_SIZE], start
+                    )
+                ]
+                yield await process(db, chunk)
+        logger.info(f"Bulk payment link request processed {len(items)} items.")
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@app.get("/pay/{token}", response_class=HTMLResponse, include_in_schema=False)
+async def pay_page(request: Request, token: str, db: AsyncSession = Depends(get_db)):
+    try:
+        payment_link = await get_link_snapshot(db, token)
+        if not payment_link:
+            return JSONResponse({"content": "Invalid payment link"}, status_code=404)
+
+        # Read-only: expiry is derived from expires_at here and written
+        # later by the expiry sweep.
+        now = datetime.now()
+        status = link_status(payment_link, now)
+        if status in ("paid", "paid_duplicate"):
+            return static_pages["paid"].response(request)
+        if status == "cancelled":
+            return static_pages["cancelled"].response(request)
+        if status != "pending":
+            return static_pages["expired"].response(request)
+
         context = {
             "request": request,
-            "amount": payment_link.amount,
+            "amount": format_amount(payment_link.amount_cents, payment_link.currency),
+            "currency": payment_link.currency,
             "order_id": payment_link.order_id,
             "email": payment_link.email,
             "token": payment_link.token,
@@ -280,25 +2105,29 @@ async def pay_page(request: Request, token: str, db: Session = Depends(get_db)):
 
 @app.post("/create_checkout_session", include_in_schema=False)
 async def create_checkout_session(
-    token: str = Form(...), db: Session = Depends(get_db)
+    token: str = Form(...), db: AsyncSession = Depends(get_db)
 ):
     try:
-        payment_link = db.query(PaymentLink).filter(PaymentLink.token == token).first()
+        # Money path: always the database's current state, never the cache.
+        payment_link = await get_link_snapshot(db, token, fresh=True)
         if not payment_link:
             raise HTTPException(status_code=404, detail="Invalid payment link.")
-        if datetime.now() > payment_link.created_at + timedelta(minutes=5):
-            raise HTTPException(status_code=400, detail="Payment link expired.")
-        if payment_link.status == "paid":
+        status = link_status(payment_link)
+        if status in ("paid", "paid_duplicate"):
             raise HTTPException(status_code=400, detail="Payment already completed.")
+        if status != "pending":
+            raise HTTPException(
+                status_code=400, detail=f"Payment link is no longer payable ({status})."
+            )
 
         try:
-            checkout_session = stripe.checkout.Session.create(
+            checkout_session = await stripe_gateway.create_checkout_session(
                 payment_method_types=["card"],
                 line_items=[
                     {
                         "price_data": {
-                            "currency": "usd",
-                            "unit_amount": int(payment_link.amount * 100),
+                            "currency": payment_link.currency,
+                            "unit_amount": payment_link.amount_cents,
                             "product_data": {"name": f"Order {payment_link.order_id}"},
                         },
                         "quantity": 1,
@@ -317,6 +2146,8 @@ async def create_checkout_session(
             )
 
         return RedirectResponse(url=checkout_session.url, status_code=303)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Error creating checkout session.")
         return JSONResponse(
@@ -327,42 +2158,17 @@ async def create_checkout_session(
 
 @app.get("/payment_success", response_class=HTMLResponse, include_in_schema=False)
 async def payment_success(
-    request: Request, token: str, session_id: str, db: Session = Depends(get_db)
+    request: Request, token: str, db: AsyncSession = Depends(get_db)
 ):
+    # Payment state is set by the Stripe webhook; this page only reads it.
     try:
-        payment_link = db.query(PaymentLink).filter(PaymentLink.token == token).first()
+        payment_link = await get_link_snapshot(db, token)
         if not payment_link:
             return JSONResponse({"content": "Invalid payment link"}, status_code=404)
-        try:
-            checkout_session = stripe.checkout.Session.retrieve(session_id)
-        except Exception as stripe_error:
-            logger.exception(f"Stripe error during session retrieval: {stripe_error}")
-            return JSONResponse(
-                {"content": "Error retrieving Stripe session."}, status_code=500
-            )
-
-        if checkout_session.payment_status != "paid":
-            logger.info(f"Stripe session not paid: {checkout_session.payment_status}")
-            return JSONResponse(
-                {"content": "Payment has not been completed."}, status_code=400
-            )
-
-        if checkout_session.metadata.get("payment_token") != token:
-            logger.warning("Stripe session metadata does not match payment token.")
-            return JSONResponse(
-                {"content": "Session mismatch: Payment token does not match."},
-                status_code=400,
-            )
 
-        if payment_link.status != "paid":
-            payment_link.status = "paid"
-            db.commit()
-            logger.info(f"Payment marked as paid for token: {payment_link.token}")
-
-        return templates.TemplateResponse(
-            "payment_success.html",
-            {"request": request, "message": "Payment successful!"},
-        )
+        if payment_link.status == "paid":
+            return static_pages["success"].response(request)
+        return static_pages["success_pending"].response(request)
     except Exception as e:
         logger.exception("Error in payment success endpoint.")
         return JSONResponse(
@@ -373,20 +2179,30 @@ async def payment_success(
 
 @app.get("/payment_cancelled", response_class=HTMLResponse, include_in_schema=False)
 async def payment_cancelled(
-    request: Request, token: str, db: Session = Depends(get_db)
+    request: Request, token: str, db: AsyncSession = Depends(get_db)
 ):
     try:
-        payment_link = db.query(PaymentLink).filter(PaymentLink.token == token).first()
+        # Only a pending link can be cancelled; a paid one must keep its
+        # slot in ux_payment_links_live_order_id.
+        cancelled = await db.scalar(
+            update(PaymentLink)
+            .where(PaymentLink.token == token, PaymentLink.status == "pending")
+            .values(status="cancelled")
+            .returning(PaymentLink.id)
+        )
+        await db.commit()
+        if cancelled is not None:
+            await link_cache.delete(token)
+            return static_pages["cancelled"].response(request)
+
+        payment_link = await get_link_snapshot(db, token, fresh=True)
         if not payment_link:
             return HTMLResponse(
                 content="<h3>Invalid payment link.</h3>", status_code=404
             )
-        payment_link.status = "cancelled"
-        db.commit()
-        return templates.TemplateResponse(
-            "payment_cancelled.html",
-            {"request": request, "message": "Payment was cancelled."},
-        )
+        if payment_link.status in ("paid", "paid_duplicate"):
+            return static_pages["paid"].response(request)
+        return static_pages["cancelled"].response(request)
     except Exception as e:
         logger.exception("Error in payment cancelled endpoint.")
         return JSONResponse(
@@ -395,31 +2211,192 @@ async def payment_cancelled(
         )
 
 
+async def claim_order_payment(db: AsyncSession, payment_link):
+    """Status for a link whose checkout was paid, keeping one live link per
+    order: other pending links for the order are expired, and if another
+    link was already paid this payment is flagged as a duplicate.
+
+    Returns the status and the tokens of the links it expired.
+    """
+    others = (
+        PaymentLink.order_id == payment_link.order_id,
+        PaymentLink.id != payment_link.id,
+    )
+    expired_tokens = await db.scalars(
+        update(PaymentLink)
+        .where(*others, PaymentLink.status == "pending")
+        .values(status="expired")
+        .returning(PaymentLink.token)
+    )
+    expired_tokens = list(expired_tokens)
+    already_paid = await db.scalar(
+        select(PaymentLink.id).where(*others, PaymentLink.status == "paid").limit(1)
+    )
+    if already_paid:
+        logger.warning(f"Order {payment_link.order_id} was paid twice.")
+        return "paid_duplicate", expired_tokens
+    return "paid", expired_tokens
+
+
+# Checkout session event -> (statuses it may move from, new status). A
+# payment for an expired or cancelled link is still recorded, through
+# claim_order_payment: it takes the order's live slot from any pending
+# link, or is flagged paid_duplicate if the order was already paid.
+STRIPE_EVENT_TRANSITIONS = {
+    "checkout.session.completed": (("pending", "expired", "cancelled"), "paid"),
+    "checkout.session.async_payment_succeeded": (
+        ("pending", "expired", "cancelled"),
+        "paid",
+    ),
+    "checkout.session.expired": (("pending",), "expired"),
+}
+
+
+@app.post("/stripe/webhook", include_in_schema=False)
+async def stripe_webhook(request: Request, db: AsyncSession = Depends(get_db)):
+    if not STRIPE_WEBHOOK_SECRET:
+        logger.error("Stripe webhook called but STRIPE_WEBHOOK_SECRET is not set.")
+        return JSONResponse({"content": "Webhook not configured"}, status_code=500)
+
+    payload = await request.body()
+    try:
+        event = stripe.Webhook.construct_event(
+            payload, request.headers.get("stripe-signature"), STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.SignatureVerificationError) as e:
+        logger.warning(f"Rejected Stripe webhook: {e}")
+        return JSONResponse({"content": "Invalid signature"}, status_code=400)
+
+    transition = STRIPE_EVENT_TRANSITIONS.get(event.type)
+    if transition is None:
+        return {"status": "ignored"}
+
+    try:
+        # Recording the event id in the same transaction as the status
+        # change makes redelivered events no-ops.
+        db.add(ProcessedStripeEvent(id=event.id, type=event.type))
+        await db.flush()
+    except IntegrityError:
+        await db.rollback()
+        return {"status": "duplicate"}
+
+    try:
+        session = event.data.object
+        token = (session.get("metadata") or {}).get("payment_token")
+        from_statuses, new_status = transition
+        paid_ok = new_status != "paid" or session.get("payment_status") == "paid"
+        payment_link = await get_link_by_token(db, token) if token else None
+        changed_tokens = []
+        if payment_link and paid_ok and payment_link.status in from_statuses:
+            if new_status == "paid":
+                new_status, changed_tokens = await claim_order_payment(db, payment_link)
+            payment_link.status = new_status
+            changed_tokens.append(payment_link.token)
+            logger.info(f"Payment link {payment_link.token} marked {new_status}.")
+        await db.commit()
+        await link_cache.delete(*changed_tokens)
+        return {"status": "processed"}
+    except Exception as e:
+        await db.rollback()
+        logger.exception("Error processing Stripe webhook.")
+        return JSONResponse({"content": f"Error: {e}"}, status_code=500)
+
+
+SearchMatch = Literal["contains", "prefix", "exact"]
+
+
+def filter_payments(query, order_id=None, email=None, status=None, match="contains"):
+    if order_id:
+        query = query.where(search_filter("order_id", order_id, match))
+    if email:
+        query = query.where(search_filter("email", email, match))
+    if status:
+        query = query.where(status_filter(status))
+    return query
+
+
+def encode_cursor(payment):
+    raw = json.dumps([payment.created_at.isoformat(), payment.id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    created_at, payment_id = json.loads(raw)
+    return datetime.fromisoformat(created_at), int(payment_id)
+
+
+_count_cache = {}  # {filters: (expires_at, total)}
+
+
+async def count_payments(db, query, filters):
+    """Row count for a filtered query, cached for COUNT_CACHE_TTL seconds."""
+    now = time.monotonic()
+    cached = _count_cache.get(filters)
+    if cached and cached[0] > now:
+        return cached[1]
+    total = await db.scalar(select(func.count()).select_from(query.subquery()))
+    if len(_count_cache) >= 1024:
+        _count_cache.clear()
+    _count_cache[filters] = (now + COUNT_CACHE_TTL, total)
+    return total
+
+
 @app.get("/payments")
 async def list_payments(
     page: int = 1,
     per_page: int = 10,
+    cursor: Optional[str] = None,
+    include_total: bool = False,
     order_id: Optional[str] = None,
     email: Optional[str] = None,
     status: Optional[str] = None,
-    db: Session = Depends(get_db),
+    match: SearchMatch = "contains",
+    db: AsyncSession = Depends(get_db),
 ):
+    """List payments, newest first.
+
+    Pass ``cursor`` (empty for the first page, then ``next_cursor``) for
+    keyset pagination; otherwise ``page``/``per_page`` offsets are used.
+    ``total`` may be up to ``COUNT_CACHE_TTL`` seconds stale and is only
+    computed in cursor mode when ``include_total`` is set.
+
+    ``match`` selects how ``order_id``/``email`` are compared: ``contains``
+    (substring, via the search index), ``prefix`` or ``exact``.
+    """
     try:
-        query = db.query(PaymentLink)
-        if order_id:
-            query = query.filter(PaymentLink.order_id.like(f"%{order_id}%"))
-        if email:
-            query = query.filter(PaymentLink.email.like(f"%{email}%"))
-        if status:
-            query = query.filter(PaymentLink.status == status)
-
-        total = query.count()
-        payments = (
-            query.order_by(PaymentLink.created_at.desc())
-            .offset((page - 1) * per_page)
-            .limit(per_page)
-            .all()
-        )
+        per_page = max(1, min(per_page, MAX_PER_PAGE))
+        query = filter_payments(select(PaymentLink), order_id, email, status, match)
+        filters = (order_id, email, status, match)
+        ordered = query.order_by(PaymentLink.created_at.desc(), PaymentLink.id.desc())
+
+        if cursor is not None:
+            if cursor:
+                try:
+                    after = decode_cursor(cursor)
+                except (ValueError, TypeError):
+                    return JSONResponse({"content": "Invalid cursor"}, status_code=400)
+                ordered = ordered.where(
+                    tuple_(PaymentLink.created_at, PaymentLink.id) < after
+                )
+            result = await db.execute(ordered.limit(per_page + 1))
+            payments = result.scalars().all()
+            has_more = len(payments) > per_page
+            payments = payments[:per_page]
+            response = {
+                "per_page": per_page,
+                "next_cursor": encode_cursor(payments[-1]) if has_more else None,
+            }
+            if include_total:
+                response["total"] = await count_payments(db, query, filters)
+        else:
+            page = max(page, 1)
+            total = await count_payments(db, query, filters)
+            result = await db.execute(
+                ordered.offset((page - 1) * per_page).limit(per_page)
+            )
+            payments = result.scalars().all()
+            response = {"page": page, "per_page": per_page, "total": total}
 
         results = []
         for payment in payments:
@@ -429,13 +2406,15 @@ async def list_payments(
                     "token": payment.token,
                     "order_id": payment.order_id,
                     "email": payment.email,
-                    "amount": payment.amount,
+                    "amount": format_amount(payment.amount_cents, payment.currency),
+                    "currency": payment.currency,
                     "created_at": payment.created_at.isoformat(),
-                    "status": payment.status,
+                    "status": link_status(payment),
                 }
             )
 
-        return {"page": page, "per_page": per_page, "total": total, "data": results}
+        response["data"] = results
+        return response
     except Exception as e:
         return JSONResponse(
             {"content": f"Error: {e}"},
@@ -443,79 +2422,108 @@ async def list_payments(
         )
 
 
+CSV_EXPORT_COLUMNS = (
+    ("ID", PaymentLink.id),
+    ("Token", PaymentLink.token),
+    ("Order ID", PaymentLink.order_id),
+    ("Email", PaymentLink.email),
+    ("Amount", PaymentLink.amount_cents),
+    ("Currency", PaymentLink.currency),
+    ("Created At", PaymentLink.created_at),
+    ("Status", PaymentLink.status),
+)
+
+
+def csv_row(row):
+    """Format a CSV_EXPORT_COLUMNS row for writing."""
+    amount = format_amount(row[4], row[5])
+    return (*row[:4], amount, row[5], row[6].isoformat(), row[7])
+
+
 @app.get("/payments/export")
 async def export_payments_csv(
     order_id: Optional[str] = None,
     email: Optional[str] = None,
     status: Optional[str] = None,
-    db: Session = Depends(get_db),
+    match: SearchMatch = "contains",
+    gzip: bool = False,
 ):
-    try:
-        import csv
-        from io import StringIO
-
-        query = db.query(PaymentLink)
-        if order_id:
-            query = query.filter(PaymentLink.order_id.like(f"%{order_id}%"))
-        if email:
-            query = query.filter(PaymentLink.email.like(f"%{email}%"))
-        if status:
-            query = query.filter(PaymentLink.status == status)
-
-        payments = query.order_by(PaymentLink.created_at.desc()).all()
-
-        si = StringIO()
-        writer = csv.writer(si)
-
-        writer.writerow(
-            ["ID", "Token", "Order ID", "Email", "Amount", "Created At", "Status"]
-        )
-
-        for payment in payments:
-            writer.writerow(
-                [
-                    payment.id,
-                    payment.token,
-                    payment.order_id,
-                    payment.email,
-                    payment.amount,
-                    payment.created_at.isoformat(),
-                    payment.status,
-                ]
+    """Stream the filtered payments as CSV (``gzip=true`` for a .csv.gz).
+
+    Rows are read through a server-side cursor ``EXPORT_CHUNK_SIZE`` at a
+    time and written out as they arrive, so memory stays flat regardless
+    of table size.
+    """
+    fields = [
+        effective_status() if field is PaymentLink.status else field
+        for _, field in CSV_EXPORT_COLUMNS
+    ]
+    query = filter_payments(
+        select(*fields),
+        order_id,
+        email,
+        status,
+        match,
+    ).order_by(PaymentLink.created_at.desc())
+
+    async def csv_chunks():
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(name for name, _ in CSV_EXPORT_COLUMNS)
+        async with SessionLocal() as db:
+            result = await db.stream(
+                query.execution_options(yield_per=EXPORT_CHUNK_SIZE)
             )
-
-        csv_content = si.getvalue()
-        response = Response(content=csv_content, media_type="text/csv")
+            async for rows in result.partitions():
+                writer.writerows(map(csv_row, rows))
+                yield buffer.getvalue().encode("utf-8")
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue().encode("utf-8")
+
+    async def gzip_chunks():
+        compressor = zlib.compressobj(wbits=31)  # gzip container
+        async for chunk in csv_chunks():
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    if gzip:
+        response = StreamingResponse(gzip_chunks(), media_type="application/gzip")
+        response.headers["Content-Disposition"] = "attachment; filename=payments.csv.gz"
+    else:
+        response = StreamingResponse(csv_chunks(), media_type="text/csv")
         response.headers["Content-Disposition"] = "attachment; filename=payments.csv"
-        return response
-    except Exception as e:
-        return JSONResponse(
-            {"content": f"Error: {e}"},
-            status_code=500,
-        )
+    return response
 
 
-# cronjob
+# Also run every EXPIRY_SWEEP_INTERVAL seconds by run_expiry_scheduler.
 @app.delete("/cleanup_expired")
-async def cleanup_expired(db: Session = Depends(get_db)):
+async def cleanup_expired():
     try:
-        expired_time = datetime.now() - timedelta(minutes=5)
-        expired_links = (
-            db.query(PaymentLink)
-            .filter(
-                PaymentLink.created_at < expired_time, PaymentLink.status == "pending"
-            )
-            .all()
-        )
-        count = len(expired_links)
-        for link in expired_links:
-            link.status = "expired"
-        db.commit()
-        logger.info(f"Cleaned up {count} expired payment links.")
-        return {"cleaned": count}
+        stats = await expire_pending_links()
+        logger.info(f"Cleaned up {stats['expired']} expired payment links.")
+        return {"cleaned": stats["expired"], **stats}
     except Exception as e:
         logger.exception("Error cleaning up expired links.")
         return JSONResponse(
             {"content": f"Error cleaning up: {e}"},
             status_code=500,
         )
+
+
+@app.get("/cleanup_expired/metrics")
+async def cleanup_expired_metrics(db: AsyncSession = Depends(get_db)):
+    """Last expiry sweep run, and the worker holding the sweep lease."""
+    lease = await db.get(SchedulerLease, "expiry_sweep")
+    if lease is None:
+        return {"holder": None, "last_run_at": None}
+    return {
+        "holder": lease.holder,
+        "lease_expires_at": lease.expires_at.isoformat(),
+        "last_run_at": lease.last_run_at and lease.last_run_at.isoformat(),
+        "last_duration_ms": lease.last_duration_ms,
+        "last_rows_affected": lease.last_rows_affected,
+    }
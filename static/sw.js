@@ -1 +0,0 @@
-console.log("Service worker is not configured.");
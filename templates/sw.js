@@ -0,0 +1,66 @@
+// Served at /sw.js by main.py, which fills in these two placeholders.
+const CACHE_VERSION = "__CACHE_VERSION__";
+const PRECACHE_URLS = __PRECACHE_URLS__;
+
+const CACHE_PREFIX = "paylink-";
+const CACHE_NAME = CACHE_PREFIX + CACHE_VERSION;
+// Pages that depend on a payment link's live state always come from the
+// network. The cached shell is only shown when the network is unreachable.
+const OFFLINE_SHELLS = [
+  ["/pay/", "/pages/offline"],
+  ["/payment_success", "/pages/success_pending"],
+  ["/payment_cancelled", "/pages/cancelled"],
+];
+const MATCH_OPTIONS = { cacheName: CACHE_NAME, ignoreVary: true };
+
+self.addEventListener("install", (event) => {
+  event.waitUntil(
+    caches
+      .open(CACHE_NAME)
+      .then((cache) => cache.addAll(PRECACHE_URLS))
+      .then(() => self.skipWaiting())
+  );
+});
+
+self.addEventListener("activate", (event) => {
+  // Drop the caches of previous versions.
+  event.waitUntil(
+    caches
+      .keys()
+      .then((names) =>
+        Promise.all(
+          names
+            .filter((name) => name.startsWith(CACHE_PREFIX) && name !== CACHE_NAME)
+            .map((name) => caches.delete(name))
+        )
+      )
+      .then(() => self.clients.claim())
+  );
+});
+
+self.addEventListener("fetch", (event) => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (request.method !== "GET" || url.origin !== self.location.origin) {
+    return;
+  }
+
+  if (request.mode === "navigate") {
+    const shell = OFFLINE_SHELLS.find(([prefix]) => url.pathname.startsWith(prefix));
+    if (shell) {
+      event.respondWith(
+        fetch(request).catch(() => caches.match(shell[1], MATCH_OPTIONS))
+      );
+    }
+    return;
+  }
+
+  // Precached files are versioned, so the cached copy is always current.
+  if (PRECACHE_URLS.includes(url.pathname)) {
+    event.respondWith(
+      caches
+        .match(request, MATCH_OPTIONS)
+        .then((cached) => cached || fetch(request))
+    );
+  }
+});
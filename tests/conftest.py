@@ -0,0 +1,104 @@
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+from sqlalchemy import select, update
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# main.py reads its settings at import time.
+os.environ.setdefault("STRIPE_PUBLIC_KEY", "pk_test")
+os.environ.setdefault("STRIPE_SECRET_KEY", "sk_test")
+os.environ["STRIPE_WEBHOOK_SECRET"] = "whsec_test"
+# TEST_DATABASE_URL runs the suite against another database, e.g. a
+# scratch Postgres one; by default it gets a throwaway SQLite file.
+os.environ["DATABASE_URL"] = os.getenv(
+    "TEST_DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/payments.db"
+)
+os.environ["LINK_CACHE_BACKEND"] = "memory"
+os.chdir(ROOT)  # templates/ and static/ are relative paths
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+for prefix in main.RATE_LIMIT_POLICIES:
+    main.RATE_LIMIT_POLICIES[prefix] = None
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def client():
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            yield client
+
+
+@pytest.fixture
+def link_request():
+    """Body for /create_payment_link; a fresh order unless one is given."""
+
+    def make(order_id=None, **fields):
+        return {
+            "order_id": order_id or uuid.uuid4().hex,
+            "email": "buyer@example.com",
+            "amount": "5",
+            **fields,
+        }
+
+    return make
+
+
+@pytest.fixture
+def create_link(client, link_request):
+    """Create a payment link and return its token."""
+
+    async def create(order_id=None, headers=None, **fields):
+        response = await client.post(
+            "/create_payment_link",
+            json=link_request(order_id, **fields),
+            headers=headers,
+        )
+        return response.json()["payment_url"].rsplit("/", 1)[-1]
+
+    return create
+
+
+@pytest.fixture
+def stored_status():
+    """The status column of a link, read from the database."""
+
+    async def read(token):
+        async with main.SessionLocal() as db:
+            return await db.scalar(
+                select(main.PaymentLink.status).where(main.PaymentLink.token == token)
+            )
+
+    return read
+
+
+@pytest.fixture
+def set_link(client):
+    """Write columns of a link directly and drop it from the link cache."""
+
+    async def write(token, **values):
+        async with main.SessionLocal() as db:
+            await db.execute(
+                update(main.PaymentLink)
+                .where(main.PaymentLink.token == token)
+                .values(**values)
+            )
+            await db.commit()
+        await main.link_cache.delete(token)
+
+    return write
@@ -0,0 +1,120 @@
+"""CompressionMiddleware, exercised through the app's own routes."""
+
+import gzip
+import uuid
+from datetime import datetime
+
+import brotli
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+DECODE = {"br": brotli.decompress, "gzip": gzip.decompress}
+ASSET = "/static/manifest.json"
+
+
+async def fetch(client, url, encoding="identity", method="GET", **headers):
+    """Response and its body as sent on the wire, before any decoding."""
+    headers["Accept-Encoding"] = encoding
+    async with client.stream(method, url, headers=headers) as response:
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+    return response, raw
+
+
+@pytest.fixture
+async def orders(create_link):
+    """A prefix matching enough fresh links to make a large /payments page."""
+    prefix = f"gz-{uuid.uuid4().hex[:8]}-"
+    for n in range(20):
+        await create_link(f"{prefix}{n}")
+    return prefix
+
+
+async def test_small_json_is_not_compressed(client):
+    response, raw = await fetch(client, "/payments?order_id=none", "br, gzip")
+    assert len(raw) < main.COMPRESSION_MIN_SIZE
+    assert "content-encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+
+
+@pytest.mark.parametrize("encoding", ["br", "gzip"])
+async def test_large_json_is_compressed(client, orders, encoding):
+    url = f"/payments?order_id={orders}&match=prefix&per_page=20"
+    plain, plain_raw = await fetch(client, url)
+    response, raw = await fetch(client, url, encoding)
+
+    assert "content-encoding" not in plain.headers
+    assert response.headers["content-encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) == len(raw) < len(plain_raw)
+    assert DECODE[encoding](raw) == plain_raw
+
+
+@pytest.mark.parametrize("encoding", ["br", "gzip"])
+async def test_streamed_csv_export_is_compressed(client, orders, encoding):
+    url = f"/payments/export?order_id={orders}&match=prefix"
+    plain, plain_raw = await fetch(client, url)
+    response, raw = await fetch(client, url, encoding)
+
+    assert response.headers["content-encoding"] == encoding
+    assert "content-length" not in response.headers
+    assert DECODE[encoding](raw) == plain_raw
+    assert plain_raw.count(orders.encode()) == 20
+
+
+async def test_gzip_export_passes_through(client, orders):
+    url = f"/payments/export?order_id={orders}&match=prefix"
+    _, csv_raw = await fetch(client, url)
+    response, raw = await fetch(client, f"{url}&gzip=true", "br, gzip")
+
+    assert "content-encoding" not in response.headers
+    assert gzip.decompress(raw) == csv_raw
+
+
+@pytest.mark.parametrize("encoding", ["br", "gzip"])
+async def test_precompressed_page_passes_through(
+    client, create_link, set_link, encoding
+):
+    token = await create_link()
+    await set_link(token, expires_at=datetime(2000, 1, 1))
+    response, raw = await fetch(client, f"/pay/{token}", encoding)
+
+    assert response.headers["content-encoding"] == encoding
+    assert raw == main.static_pages["expired"].variants[encoding][0]
+
+
+async def test_not_modified_partial_and_head_pass_through(client):
+    response, _ = await fetch(client, ASSET)
+    etag = response.headers["etag"]
+
+    not_modified, raw = await fetch(client, ASSET, "gzip", **{"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert raw == b""
+    assert "content-encoding" not in not_modified.headers
+
+    partial, raw = await fetch(client, ASSET, "gzip", Range="bytes=0-99")
+    assert partial.status_code == 206
+    assert len(raw) == 100
+    assert "content-encoding" not in partial.headers
+
+    head, raw = await fetch(client, ASSET, "gzip", method="HEAD")
+    assert head.status_code == 200
+    assert raw == b""
+    assert "content-encoding" not in head.headers
+    assert head.headers["content-length"] == response.headers["content-length"]
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        ("br;q=0, gzip", "gzip"),
+        ("gzip;q=0", None),
+        ("br;q=0.0, gzip;q=0", None),
+        ("gzip;q=0.5, br;q=1", "br"),
+    ],
+)
+async def test_zero_quality_codings_are_refused(client, accept, expected):
+    response, _ = await fetch(client, ASSET, accept)
+    assert response.headers.get("content-encoding") == expected
@@ -0,0 +1,91 @@
+"""Concurrent requests for the same order must converge on one live link."""
+
+import asyncio
+import json
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def live_link_counts(order_ids):
+    async with main.SessionLocal() as db:
+        rows = await db.execute(
+            select(main.PaymentLink.order_id, func.count())
+            .where(
+                main.PaymentLink.order_id.in_(order_ids),
+                main.PaymentLink.status.in_(("pending", "paid")),
+            )
+            .group_by(main.PaymentLink.order_id)
+        )
+        return dict(rows.all())
+
+
+async def test_concurrent_creates_return_one_link_per_order(client, link_request):
+    prefix = uuid.uuid4().hex[:8]
+    orders = [f"{prefix}-{i}" for i in range(20)]
+    for order_id in orders:
+        responses = await asyncio.gather(
+            *(
+                client.post("/create_payment_link", json=link_request(order_id))
+                for _ in range(30)
+            )
+        )
+        assert [r.status_code for r in responses] == [200] * 30
+        assert len({r.json()["payment_url"] for r in responses}) == 1
+
+    assert await live_link_counts(orders) == dict.fromkeys(orders, 1)
+
+
+async def test_concurrent_bulk_and_single_creates_agree(client, link_request):
+    prefix = uuid.uuid4().hex[:8]
+    orders = [f"{prefix}-{i}" for i in range(300)]
+    body = [link_request(orders[i % len(orders)]) for i in range(600)]
+    responses = await asyncio.gather(
+        *(client.post("/create_payment_links/bulk", json=body) for _ in range(6)),
+        *(
+            client.post("/create_payment_link", json=link_request(order_id))
+            for order_id in orders[:10]
+        ),
+    )
+
+    urls = {order_id: set() for order_id in orders}
+    for response in responses[:6]:
+        results = [json.loads(line) for line in response.text.splitlines()]
+        assert [r["index"] for r in results] == list(range(600))
+        assert {r["status"] for r in results} == {"success"}
+        for result in results:
+            urls[result["order_id"]].add(result["payment_url"])
+    for order_id, response in zip(orders, responses[6:]):
+        urls[order_id].add(response.json()["payment_url"])
+
+    assert all(len(order_urls) == 1 for order_urls in urls.values())
+    assert await live_link_counts(orders) == dict.fromkeys(orders, 1)
+
+
+async def test_cancel_leaves_paid_link_paid(
+    client, link_request, create_link, stored_status, set_link
+):
+    order_id = uuid.uuid4().hex
+    token = await create_link(order_id)
+    await set_link(token, status="paid")
+
+    response = await client.get("/payment_cancelled", params={"token": token})
+    assert response.status_code == 200
+    assert await stored_status(token) == "paid"
+    # The paid link still holds the order's live slot.
+    response = await client.post("/create_payment_link", json=link_request(order_id))
+    assert response.json()["message"] == "Order has already been paid."
+
+
+async def test_cancel_pending_link(client, create_link):
+    token = await create_link()
+
+    response = await client.get("/payment_cancelled", params={"token": token})
+    assert response.status_code == 200
+    response = await client.get(f"/pay/{token}")
+    assert "cancelled" in response.text.lower()
@@ -0,0 +1,53 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+PAST = datetime(2000, 1, 1)
+
+
+async def test_lease_has_one_holder_until_it_expires(client):
+    name = f"lease-{uuid.uuid4().hex}"
+    assert await main.acquire_lease(name, 60, holder="a")
+    assert not await main.acquire_lease(name, 60, holder="b")
+    assert await main.acquire_lease(name, 60, holder="a")  # renewal
+
+    assert await main.acquire_lease(name, -1, holder="a")  # lapses at once
+    assert await main.acquire_lease(name, 60, holder="b")
+    assert not await main.acquire_lease(name, 60, holder="a")
+
+
+async def test_sweep_expires_due_links_in_batches(
+    client, create_link, stored_status, set_link
+):
+    await main.expire_pending_links()  # leftovers from other tests
+    due = [await create_link() for _ in range(5)]
+    for token in due:
+        await set_link(token, expires_at=PAST)
+    paid = await create_link()
+    await set_link(paid, status="paid", expires_at=PAST)
+    live = await create_link()
+    assert await main.acquire_lease("expiry_sweep", 60, holder="test-worker")
+
+    stats = await main.expire_pending_links(batch_size=2)
+
+    assert stats["expired"] == 5
+    assert stats["batches"] == 3
+    assert [await stored_status(token) for token in due] == ["expired"] * 5
+    assert await stored_status(paid) == "paid"
+    assert await stored_status(live) == "pending"
+
+    metrics = (await client.get("/cleanup_expired/metrics")).json()
+    assert metrics["holder"] == "test-worker"
+    assert metrics["last_rows_affected"] == 5
+    assert metrics["last_run_at"] is not None
+
+
+async def test_sweep_with_nothing_due(client):
+    await main.expire_pending_links()
+    stats = await main.expire_pending_links()
+    assert stats["expired"] == stats["batches"] == 0
@@ -0,0 +1,135 @@
+"""Idempotency-Key handling on /create_payment_link."""
+
+import hashlib
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, select, update
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+PAST = datetime(2000, 1, 1)
+
+
+def request_hash(body):
+    data = main.PaymentLinkCreate(**body)
+    return hashlib.sha256(data.model_dump_json().encode()).hexdigest()
+
+
+async def stored_key(key):
+    async with main.SessionLocal() as db:
+        return await db.get(main.IdempotencyKey, key)
+
+
+async def expire_key(key):
+    async with main.SessionLocal() as db:
+        await db.execute(
+            update(main.IdempotencyKey)
+            .where(main.IdempotencyKey.key == key)
+            .values(expires_at=PAST)
+        )
+        await db.commit()
+
+
+async def post(client, body, key):
+    return await client.post(
+        "/create_payment_link", json=body, headers={"Idempotency-Key": key}
+    )
+
+
+async def test_retry_replays_first_response(client, link_request):
+    key, body = uuid.uuid4().hex, link_request()
+    first = await post(client, body, key)
+    retry = await post(client, body, key)
+
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.status_code == first.status_code
+    assert retry.content == first.content
+
+
+async def test_different_body_is_rejected(client, link_request):
+    key = uuid.uuid4().hex
+    await post(client, link_request(), key)
+    response = await post(client, link_request(), key)
+    assert response.status_code == 422
+
+
+async def test_in_flight_key_conflicts(client, link_request):
+    key, body = uuid.uuid4().hex, link_request()
+    async with main.SessionLocal() as db:
+        assert await main.claim_idempotency_key(db, key, request_hash(body)) is None
+
+    response = await post(client, body, key)
+    assert response.status_code == 409
+
+
+async def test_expired_key_is_taken_over(client, link_request):
+    key = uuid.uuid4().hex
+    first = await post(client, link_request(), key)
+    await expire_key(key)
+
+    body = link_request()
+    response = await post(client, body, key)
+
+    assert "Idempotent-Replayed" not in response.headers
+    assert response.json()["payment_url"] != first.json()["payment_url"]
+    entry = await stored_key(key)
+    assert entry.request_hash == request_hash(body)
+    assert entry.response_body == response.content
+
+
+async def test_server_errors_are_not_stored(client, link_request, monkeypatch):
+    async def fail(data, db):
+        return JSONResponse({"content": "boom"}, status_code=503)
+
+    monkeypatch.setattr(main, "create_or_get_payment_link", fail)
+    key, body = uuid.uuid4().hex, link_request()
+
+    assert (await post(client, body, key)).status_code == 503
+    assert await stored_key(key) is None
+    monkeypatch.undo()
+    retry = await post(client, body, key)
+    assert retry.status_code == 200
+    assert "Idempotent-Replayed" not in retry.headers
+
+
+async def test_sweep_deletes_expired_keys_in_batches(client):
+    await main.sweep_idempotency_keys()  # leftovers from other tests
+    expired = [uuid.uuid4().hex for _ in range(5)]
+    live = uuid.uuid4().hex
+    async with main.SessionLocal() as db:
+        for key in expired:
+            db.add(main.IdempotencyKey(key=key, request_hash="-", expires_at=PAST))
+        db.add(
+            main.IdempotencyKey(
+                key=live, request_hash="-", expires_at=datetime(2100, 1, 1)
+            )
+        )
+        await db.commit()
+
+    deletes = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("DELETE FROM IDEMPOTENCY_KEYS"):
+            deletes.append(statement)
+
+    event.listen(main.engine.sync_engine, "before_cursor_execute", record)
+    try:
+        removed = await main.sweep_idempotency_keys(batch_size=2)
+    finally:
+        event.remove(main.engine.sync_engine, "before_cursor_execute", record)
+
+    assert removed == 5
+    assert len(deletes) == 3
+    async with main.SessionLocal() as db:
+        keys = await db.scalars(
+            select(main.IdempotencyKey.key).where(
+                main.IdempotencyKey.key.in_([*expired, live])
+            )
+        )
+        assert list(keys) == [live]
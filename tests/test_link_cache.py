@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import fakeredis
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def snapshot(token, status="pending"):
+    now = datetime.now().replace(microsecond=0)
+    return main.LinkSnapshot(
+        1, token, "order-1", "buyer@example.com", 500, "usd", now, status, now
+    )
+
+
+@pytest.fixture(params=["memory", "redis"])
+def cache(request):
+    if request.param == "redis":
+        return main.RedisLinkCache(client=fakeredis.FakeAsyncRedis())
+    return main.InMemoryLinkCache()
+
+
+async def fill(cache, link):
+    await cache.set(link, await cache.version(link.token))
+
+
+async def test_get_set_delete(cache):
+    link = snapshot("tok")
+    assert await cache.get("tok") is None
+    await fill(cache, link)
+    assert await cache.get("tok") == link
+    await cache.delete("tok", "other")
+    assert await cache.get("tok") is None
+
+
+async def test_fill_after_invalidation_is_dropped(cache):
+    # Read from the database, then the link is paid and invalidated before
+    # the fill lands.
+    version = await cache.version("tok")
+    stale = snapshot("tok")
+    await cache.delete("tok")
+    await cache.set(stale, version)
+    assert await cache.get("tok") is None
+
+    await fill(cache, snapshot("tok", "paid"))
+    assert (await cache.get("tok")).status == "paid"
+
+
+async def test_lru_evicts_least_recently_used():
+    cache = main.InMemoryLinkCache(max_entries=2)
+    for token in ("a", "b"):
+        await fill(cache, snapshot(token))
+    await cache.get("a")
+    await fill(cache, snapshot("c"))
+    assert await cache.get("a") is not None
+    assert await cache.get("b") is None
+
+
+async def test_redis_entries_expire():
+    client = fakeredis.FakeAsyncRedis()
+    cache = main.RedisLinkCache(client=client, ttl=30)
+    await fill(cache, snapshot("tok"))
+    assert 0 < await client.ttl("link:tok") <= 30
+
+
+def test_link_cache_is_abstract():
+    with pytest.raises(TypeError):
+        main.LinkCache()
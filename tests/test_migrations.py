@@ -0,0 +1,70 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import main
+
+START_WORKER = """
+import asyncio, main
+async def start():
+    await main.init_db()
+    await main.engine.dispose()
+asyncio.run(start())
+"""
+
+
+def start_workers(database, count):
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{database}"}
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-c", START_WORKER],
+            cwd=os.path.dirname(os.path.abspath(main.__file__)),
+            env=env,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        for _ in range(count)
+    ]
+    return [(worker.wait(), worker.stderr.read()) for worker in workers]
+
+
+def applied_versions(database):
+    with sqlite3.connect(database) as db:
+        return [v for (v,) in db.execute("SELECT version FROM schema_migrations")]
+
+
+def test_workers_starting_together_on_a_fresh_database(tmp_path):
+    database = tmp_path / "payments.db"
+    for code, stderr in start_workers(database, 4):
+        assert code == 0, stderr
+    assert sorted(applied_versions(database)) == list(
+        range(1, len(main.MIGRATIONS) + 1)
+    )
+
+
+def test_workers_starting_together_migrate_an_old_database(tmp_path):
+    database = tmp_path / "payments.db"
+    with sqlite3.connect(database) as db:
+        db.execute(
+            "CREATE TABLE payment_links (id INTEGER PRIMARY KEY, token VARCHAR,"
+            " order_id VARCHAR, email VARCHAR, amount FLOAT, created_at DATETIME,"
+            " status VARCHAR)"
+        )
+        db.executemany(
+            "INSERT INTO payment_links (token, order_id, email, amount, created_at,"
+            " status) VALUES (?, ?, ?, 1.5, '2024-01-01 00:00:00.000000', ?)",
+            [(f"t{i}", f"o{i % 10}", "buyer@example.com", "paid") for i in range(100)],
+        )
+
+    for code, stderr in start_workers(database, 4):
+        assert code == 0, stderr
+    with sqlite3.connect(database) as db:
+        statuses = dict(
+            db.execute("SELECT status, count(*) FROM payment_links GROUP BY status")
+        )
+        amounts = {a for (a,) in db.execute("SELECT amount_cents FROM payment_links")}
+    # Migrated exactly once: one paid link per order, the rest flagged.
+    assert statuses == {"paid": 10, "paid_duplicate": 90}
+    assert amounts == {150}
+    assert len(applied_versions(database)) == len(main.MIGRATIONS)
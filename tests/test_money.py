@@ -0,0 +1,35 @@
+from decimal import Decimal
+
+import pytest
+from pydantic import ValidationError
+
+import main
+
+
+@pytest.mark.parametrize(
+    "currency, amount, minor, formatted",
+    [
+        ("usd", "19.99", 1999, "19.99"),
+        ("jpy", "500", 500, "500"),
+        ("bhd", "1.25", 1250, "1.250"),
+        ("kwd", "0.5", 500, "0.500"),
+        ("tnd", "12.34", 12340, "12.340"),
+    ],
+)
+def test_minor_units(currency, amount, minor, formatted):
+    assert main.to_minor_units(Decimal(amount), currency) == minor
+    assert main.format_amount(minor, currency) == formatted
+
+
+def link(amount, currency):
+    return main.PaymentLinkCreate(
+        order_id="o", email="buyer@example.com", amount=amount, currency=currency
+    )
+
+
+def test_three_decimal_amounts():
+    assert link("1.23", "JOD").amount_cents == 1230
+    with pytest.raises(ValidationError):
+        link("1.235", "omr")  # Stripe needs the last digit to be 0
+    with pytest.raises(ValidationError):
+        link("1.2345", "bhd")
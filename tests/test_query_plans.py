@@ -0,0 +1,120 @@
+"""Hot queries must be answered from an index, never a full table scan.
+
+The SQL is captured from the real code paths and run through SQLite's
+EXPLAIN QUERY PLAN.
+"""
+
+import re
+import uuid
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+import main
+
+pytestmark = [
+    pytest.mark.anyio,
+    pytest.mark.skipif(main.engine.dialect.name != "sqlite", reason="SQLite plans"),
+]
+
+FULL_SCAN = re.compile(r"\bSCAN payment_links(?! USING)(\s|$)")
+
+
+@contextmanager
+def captured_statements():
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if "payment_links" in statement and not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(main.engine.sync_engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(main.engine.sync_engine, "before_cursor_execute", record)
+
+
+async def query_plans(statements):
+    plans = []
+    async with main.engine.connect() as conn:
+        for statement, parameters in statements:
+            plan = await conn.exec_driver_sql(
+                f"EXPLAIN QUERY PLAN {statement}", parameters
+            )
+            plans.append((statement, [row[-1] for row in plan]))
+    return plans
+
+
+async def full_scans(statements):
+    return [
+        (statement, details)
+        for statement, details in await query_plans(statements)
+        if any(FULL_SCAN.search(detail) for detail in details)
+    ]
+
+
+async def test_hot_queries_use_indexes(client, link_request, create_link, set_link):
+    prefix = uuid.uuid4().hex[:8]
+    for i in range(50):
+        await create_link(f"{prefix}-{i}")
+    # Give the expiry sweep something to update.
+    stale = await create_link(f"{prefix}-stale")
+    await set_link(stale, expires_at=main.datetime(2000, 1, 1))
+
+    with captured_statements() as statements:
+        # Idempotent create, then the order lookup on a repeat.
+        token = await create_link(
+            f"{prefix}-new", headers={"Idempotency-Key": uuid.uuid4().hex}
+        )
+        await create_link(f"{prefix}-new")
+        # Token lookup.
+        await client.get(f"/pay/{token}")
+        # Bulk dedupe (find_live_links).
+        body = [link_request(f"{prefix}-{i % 60}") for i in range(120)]
+        await client.post("/create_payment_links/bulk", json=body)
+        # Status filters in keyset and offset order (status_filter), and
+        # the search filters (filter_payments).
+        for status in ("pending", "paid", "expired", "cancelled"):
+            first = await client.get(
+                "/payments",
+                params={"status": status, "cursor": "", "per_page": 5},
+            )
+            await client.get("/payments", params={"status": status})
+            if first.json()["next_cursor"]:
+                await client.get(
+                    "/payments",
+                    params={"status": status, "cursor": first.json()["next_cursor"]},
+                )
+        for match in ("exact", "prefix", "contains"):
+            await client.get("/payments", params={"order_id": prefix, "match": match})
+            await client.get("/payments", params={"email": "buyer@", "match": match})
+        # Expiry sweep.
+        await main.expire_pending_links()
+
+    assert statements
+    assert await full_scans(statements) == []
+
+
+async def test_full_scan_is_detected(client):
+    statement = "SELECT id FROM payment_links WHERE amount_cents = ?"
+    assert len(await full_scans([(statement, (300,))])) == 1
+
+
+async def test_sweep_batches_update_by_primary_key(client, create_link, set_link):
+    for _ in range(3):
+        await set_link(await create_link(), expires_at=main.datetime(2000, 1, 1))
+
+    with captured_statements() as statements:
+        await main.expire_pending_links(batch_size=2)
+
+    updates = [
+        details
+        for statement, details in await query_plans(statements)
+        if statement.startswith("UPDATE payment_links")
+    ]
+    assert len(updates) == 2
+    # Each batch touches only its own rows, not every remaining due link.
+    for details in updates:
+        assert details == ["SEARCH payment_links USING INTEGER PRIMARY KEY (rowid=?)"]
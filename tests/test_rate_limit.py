@@ -0,0 +1,69 @@
+import time
+import uuid
+
+import fakeredis
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_in_memory_backend_limits_per_key():
+    backend = main.InMemoryRateLimitBackend()
+    assert [await backend.hit("a", 2, 60) for _ in range(3)] == [True, True, False]
+    assert await backend.hit("b", 2, 60)
+
+
+async def test_in_memory_backend_evicts_least_recently_seen():
+    backend = main.InMemoryRateLimitBackend(max_keys=2)
+    await backend.hit("a", 10, 60)
+    await backend.hit("b", 10, 60)
+    await backend.hit("a", 10, 60)
+    await backend.hit("c", 10, 60)
+    assert list(backend.counters) == ["a", "c"]
+
+
+@pytest.fixture
+def redis_backend():
+    return main.RedisRateLimitBackend(
+        client=fakeredis.FakeAsyncRedis(), prefix=f"test-{uuid.uuid4().hex}"
+    )
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Pin time.time() to the start of a fresh 60 second window."""
+    now = [(int(time.time()) // 60 + 1) * 60]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+async def hits(backend, key, count, limit=3, window=60):
+    return [await backend.hit(key, limit, window) for _ in range(count)]
+
+
+async def test_redis_backend_limits_per_key(redis_backend):
+    assert await hits(redis_backend, "a", 5) == [True, True, True, False, False]
+    assert await hits(redis_backend, "b", 1) == [True]
+
+
+async def test_redis_backend_does_not_count_rejected_hits(redis_backend, clock):
+    await hits(redis_backend, "a", 5)
+    current = f"{redis_backend.prefix}:a:{clock[0] // 60}"
+    assert int(await redis_backend.redis.get(current)) == 3
+
+
+async def test_redis_backend_window_rolls_over(redis_backend, clock):
+    assert await hits(redis_backend, "a", 4) == [True, True, True, False]
+    # Halfway through the next window, half the previous count still counts.
+    clock[0] += 90
+    assert await hits(redis_backend, "a", 3) == [True, True, False]
+    # Two windows on, nothing overlaps any more.
+    clock[0] += 120
+    assert await hits(redis_backend, "a", 4) == [True, True, True, False]
+
+
+def test_rate_limit_backend_is_abstract():
+    with pytest.raises(TypeError):
+        main.RateLimitBackend()
@@ -0,0 +1,45 @@
+import uuid
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql, sqlite
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+MAX_CHAR = "\U0010ffff"
+
+
+async def prefix_search(client, prefix):
+    response = await client.get(
+        "/payments", params={"order_id": prefix, "match": "prefix", "per_page": 100}
+    )
+    assert response.status_code == 200
+    return sorted(payment["order_id"] for payment in response.json()["data"])
+
+
+async def test_prefix_search(client, create_link):
+    base = uuid.uuid4().hex
+    for order_id in (f"{base}-1", f"{base}-2", f"{base}x"):
+        await create_link(order_id)
+    assert await prefix_search(client, f"{base}-") == [f"{base}-1", f"{base}-2"]
+
+
+async def test_prefix_ending_in_last_code_point(client, create_link):
+    base = uuid.uuid4().hex
+    inside = [f"{base}{MAX_CHAR}", f"{base}{MAX_CHAR}a", f"{base}{MAX_CHAR * 2}"]
+    for order_id in (*inside, f"{base}a", f"{base[:-1]}z"):
+        await create_link(order_id)
+    assert await prefix_search(client, f"{base}{MAX_CHAR}") == sorted(inside)
+    assert await prefix_search(client, MAX_CHAR * 3) == []
+
+
+@pytest.mark.parametrize("dialect, collated", [(postgresql, 2), (sqlite, 0)])
+def test_prefix_range_uses_code_point_order(monkeypatch, dialect, collated):
+    # Under a linguistic collation such as en_US.UTF-8, 'ab-1' sorts after
+    # 'ab.' and would fall outside the range.
+    monkeypatch.setattr(main, "engine", SimpleNamespace(dialect=dialect.dialect()))
+    clause = main.search_filter("order_id", "ab-", match="prefix")
+    sql = str(clause.compile(dialect=dialect.dialect()))
+    assert sql.count('COLLATE "C"') == collated
@@ -0,0 +1,45 @@
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def response_headers(middleware, path):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware({"type": "http", "path": path}, None, send)
+    return dict(messages[0]["headers"])
+
+
+async def app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def test_nonce_mode_keeps_docs_policy():
+    middleware = main.ContentSecurityPolicyMiddleware(
+        app, use_nonce=True, path_directives={"/": main.DOCS_CSP_DIRECTIVES}
+    )
+
+    page = await response_headers(middleware, "/pay/abc")
+    assert b"'nonce-" in page[b"content-security-policy"]
+    assert b"unsafe-inline" not in page[b"content-security-policy"]
+    assert page[b"x-content-type-options"] == b"nosniff"
+
+    docs = await response_headers(middleware, "/")
+    assert docs[b"content-security-policy"] == (
+        main.ContentSecurityPolicyMiddleware.build_csp(main.DOCS_CSP_DIRECTIVES)[0]
+    )
+    assert b"'unsafe-inline'" in docs[b"content-security-policy"]
+    assert b"'nonce-" not in docs[b"content-security-policy"]
+
+
+async def test_nonce_changes_per_request():
+    middleware = main.ContentSecurityPolicyMiddleware(app, use_nonce=True)
+    first = await response_headers(middleware, "/pay/abc")
+    second = await response_headers(middleware, "/pay/abc")
+    assert first[b"content-security-policy"] != second[b"content-security-policy"]
@@ -0,0 +1,20 @@
+import json
+import re
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_service_worker_is_filled_in(client):
+    response = await client.get("/sw.js")
+    assert response.status_code == 200
+    assert "__CACHE_VERSION__" not in response.text
+    assert "__PRECACHE_URLS__" not in response.text
+    urls = json.loads(re.search(r"PRECACHE_URLS = (\[.*?\]);", response.text)[1])
+    assert "/pages/offline" in urls
+
+
+async def test_template_is_not_served_as_a_static_file(client):
+    response = await client.get("/static/sw.js")
+    assert response.status_code == 404
@@ -0,0 +1,69 @@
+"""Pre-rendered status pages, served for /pay/{token} on an expired link."""
+
+import gzip
+from datetime import datetime
+
+import brotli
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+DECODE = {None: bytes, "br": brotli.decompress, "gzip": gzip.decompress}
+
+
+@pytest.fixture
+async def expired_url(create_link, set_link):
+    token = await create_link()
+    await set_link(token, expires_at=datetime(2000, 1, 1))
+    return f"/pay/{token}"
+
+
+async def fetch(client, url, encoding, **headers):
+    """Response and its body as sent, before any decoding."""
+    headers["Accept-Encoding"] = encoding or "identity"
+    async with client.stream("GET", url, headers=headers) as response:
+        raw = b"".join([chunk async for chunk in response.aiter_raw()])
+    return response, raw
+
+
+async def test_expired_link_serves_each_variant(client, expired_url):
+    page = main.static_pages["expired"]
+    etags = set()
+    for encoding in (None, "gzip", "br"):
+        response, raw = await fetch(client, expired_url, encoding)
+
+        assert response.status_code == 200
+        assert response.headers.get("content-encoding") == encoding
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.headers["cache-control"] == "no-cache"
+        assert (raw, response.headers["etag"]) == page.variants[encoding]
+        assert DECODE[encoding](raw) == page.variants[None][0]
+        assert b"This payment link has expired." in DECODE[encoding](raw)
+        etags.add(response.headers["etag"])
+
+    assert len(etags) == 3
+    assert not any(etag.startswith("W/") for etag in etags)
+
+
+@pytest.mark.parametrize("encoding", [None, "gzip", "br"])
+async def test_matching_etag_is_not_modified(client, expired_url, encoding):
+    first, _ = await fetch(client, expired_url, encoding)
+    etag = first.headers["etag"]
+
+    response, raw = await fetch(
+        client, expired_url, encoding, **{"If-None-Match": f'"other", {etag}'}
+    )
+    assert response.status_code == 304
+    assert raw == b""
+    assert response.headers["etag"] == etag
+
+
+async def test_other_encodings_etag_is_modified(client, expired_url):
+    gzipped, _ = await fetch(client, expired_url, "gzip")
+    response, _ = await fetch(
+        client, expired_url, "br", **{"If-None-Match": gzipped.headers["etag"]}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "br"
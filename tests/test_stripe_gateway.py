@@ -0,0 +1,21 @@
+import asyncio
+
+import pytest
+
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_request_not_started_when_waiting_for_a_slot_times_out():
+    gateway = main.StripeGateway("sk_test", max_concurrency=1, timeout=0.05)
+    started = []
+
+    async def request():
+        started.append(True)
+        await asyncio.sleep(1)
+
+    await gateway._semaphore.acquire()  # every slot busy
+    with pytest.raises(asyncio.TimeoutError):
+        await gateway._call(request)
+    assert started == []
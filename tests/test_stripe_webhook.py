@@ -0,0 +1,85 @@
+"""Stripe webhooks, with events signed locally using STRIPE_WEBHOOK_SECRET."""
+
+import hashlib
+import hmac
+import json
+import time
+import uuid
+
+import pytest
+import main
+
+pytestmark = pytest.mark.anyio
+
+
+def stripe_event(event_type, token, payment_status="paid"):
+    return {
+        "id": f"evt_{uuid.uuid4().hex}",
+        "object": "event",
+        "type": event_type,
+        "data": {
+            "object": {
+                "object": "checkout.session",
+                "payment_status": payment_status,
+                "metadata": {"payment_token": token},
+            }
+        },
+    }
+
+
+def signed(event, secret=main.STRIPE_WEBHOOK_SECRET):
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(
+        secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256
+    ).hexdigest()
+    headers = {
+        "stripe-signature": f"t={timestamp},v1={signature}",
+        "content-type": "application/json",
+    }
+    return payload, headers
+
+
+async def deliver(client, event, **kwargs):
+    payload, headers = signed(event, **kwargs)
+    return await client.post("/stripe/webhook", content=payload, headers=headers)
+
+
+async def test_completed_checkout_marks_link_paid(client, create_link, stored_status):
+    token = await create_link()
+    response = await deliver(client, stripe_event("checkout.session.completed", token))
+    assert response.json() == {"status": "processed"}
+    assert await stored_status(token) == "paid"
+
+
+async def test_redelivered_event_is_duplicate(client, create_link, stored_status):
+    token = await create_link()
+    event = stripe_event("checkout.session.completed", token)
+    await deliver(client, event)
+    response = await deliver(client, event)
+    assert response.json() == {"status": "duplicate"}
+    assert await stored_status(token) == "paid"
+
+
+async def test_bad_signature_is_rejected(client, create_link, stored_status):
+    token = await create_link()
+    event = stripe_event("checkout.session.completed", token)
+    response = await deliver(client, event, secret="whsec_wrong")
+    assert response.status_code == 400
+    assert await stored_status(token) == "pending"
+
+
+async def test_expired_after_paid_is_ignored(client, create_link, stored_status):
+    token = await create_link()
+    await deliver(client, stripe_event("checkout.session.completed", token))
+    response = await deliver(client, stripe_event("checkout.session.expired", token))
+    assert response.json() == {"status": "processed"}
+    assert await stored_status(token) == "paid"
+
+
+async def test_unpaid_completion_does_not_mark_paid(client, create_link, stored_status):
+    token = await create_link()
+    event = stripe_event("checkout.session.completed", token, payment_status="unpaid")
+    response = await deliver(client, event)
+    assert response.json() == {"status": "processed"}
+    assert await stored_status(token) == "pending"